@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import aiohttp
+
+from benchmarks.fake_trip import start_fake_trip
+from benchmarks.load import BACKEND_DIR, spawn, wait_until_up
+
+HOTELS_API_DIR = os.path.join(BACKEND_DIR, "hotels_api")
+IMPORT_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import app
+print(json.dumps({"seconds": time.perf_counter() - started, "selenium": "selenium_driverless" in sys.modules}))
+"""
+
+
+def measure_import(runs: int) -> dict[str, object]:
+    samples = []
+    selenium = False
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=HOTELS_API_DIR, capture_output=True,
+                                text=True, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        samples.append(result["seconds"])
+        selenium = selenium or result["selenium"]
+    return {"median_ms": round(statistics.median(samples) * 1000, 1), "min_ms": round(min(samples) * 1000, 1),
+            "selenium_imported": selenium}
+
+
+async def timed_get(session: aiohttp.ClientSession, url: str, params: dict[str, object]) -> float:
+    started = time.perf_counter()
+    async with session.get(url, params=params) as r:
+        r.raise_for_status()
+        await r.read()
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+async def measure_startup(name: str, port: int, trip_options: dict[str, float], env: dict[str, str],
+                          city: str) -> dict[str, object]:
+    trip_runner, fake_trip = await start_fake_trip(port=port, **trip_options)
+    state_dir = tempfile.TemporaryDirectory()
+    hotels_url = f"http://127.0.0.1:{port + 1}"
+    started = time.perf_counter()
+    process = spawn("app:app", HOTELS_API_DIR, port + 1, {
+        "TRIP_BASE_URL": f"http://127.0.0.1:{port}",
+        "CITY_CACHE_PATH": os.path.join(state_dir.name, "city_cache.sqlite3"),
+        "MONITOR_DB_PATH": os.path.join(state_dir.name, "monitor.sqlite3"),
+        **env,
+    })
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, f"{hotels_url}/ready", process, timeout=60)
+            ready_ms = round((time.perf_counter() - started) * 1000, 1)
+            async with session.get(f"{hotels_url}/ready") as r:
+                warmup = await r.json()
+            connections_before = fake_trip.counters.get("connections", 0)
+
+            check_in = date.today() + timedelta(days=30)
+            search_city_ms = await timed_get(session, f"{hotels_url}/search-city", {"city": city})
+            find_hotels_ms = await timed_get(session, f"{hotels_url}/find-hotels-of-city", {
+                "cityId": 1, "cityName": city, "checkInDate": check_in.isoformat(),
+                "checkOutDate": (check_in + timedelta(days=2)).isoformat(), "adultsCount": 2, "childrenCount": 0,
+            })
+    finally:
+        process.terminate()
+        with contextlib.suppress(subprocess.TimeoutExpired):
+            process.wait(timeout=10)
+        await trip_runner.cleanup()
+        state_dir.cleanup()
+
+    return {
+        "mode": name,
+        "ready_ms": ready_ms,
+        "warmup_seconds": warmup["seconds"],
+        "first_search_city_ms": search_city_ms,
+        "first_find_hotels_ms": find_hotels_ms,
+        "connections_on_requests": fake_trip.counters.get("connections", 0) - connections_before,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Import time of hotels_api and latency of the first requests after "
+                                                 "startup, with and without the warm-up phase")
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--cities", default="Almaty,Astana,Dubai,Istanbul,Tbilisi",
+                        help="WARMUP_CITIES of the warm run, the first one is requested afterwards")
+    parser.add_argument("--trip-latency", type=float, default=0.1)
+    parser.add_argument("--connect-latency", type=float, default=0.3,
+                        help="simulated TCP and TLS handshake cost of a new upstream connection")
+    parser.add_argument("--base-port", type=int, default=8930)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print(f"importing app {args.import_runs} times")
+    import_result = measure_import(args.import_runs)
+
+    trip_options = {"latency": args.trip_latency, "jitter": 0.0, "connect_latency": args.connect_latency}
+    city = args.cities.split(",")[0]
+    startups = []
+    for name, env in (("cold", {"WARMUP_TIMEOUT": "0"}), ("warm", {"WARMUP_CITIES": args.cities})):
+        print(f"starting hotels_api {name}")
+        startups.append(await measure_startup(name, args.base_port, trip_options, env, city))
+
+    print(f"\nimport app: median {import_result['median_ms']} ms, min {import_result['min_ms']} ms, "
+          f"selenium_driverless imported: {import_result['selenium_imported']}")
+    print(f"\n{'mode':<6}{'ready ms':>10}{'warm-up s':>11}{'search-city ms':>16}{'find-hotels ms':>16}"
+          f"{'new conns':>11}")
+    for result in startups:
+        print(f"{result['mode']:<6}{result['ready_ms']:>10}{str(result['warmup_seconds']):>11}"
+              f"{result['first_search_city_ms']:>16}{result['first_find_hotels_ms']:>16}"
+              f"{result['connections_on_requests']:>11}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": vars(args), "import": import_result, "startup": startups}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
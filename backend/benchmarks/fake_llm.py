@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import date, timedelta
+
+from aiohttp import web
+
+DEFAULT_SCRIPT = ("find_hotels", "find_hotel_comments", "answer")
+
+
+def user_city(message: str) -> str:
+    # "Find hotels in Almaty" -> "Almaty"
+    return message.rsplit(" in ", 1)[-1].strip(" ?.!") or "Almaty"
+
+
+def first_hotel_id(content: str) -> int:
+    try:
+        hotels = json.loads(content)
+        return int(hotels[0]["hotelId"])
+    except (ValueError, TypeError, LookupError):
+        return 1
+
+
+class FakeLLM:
+    def __init__(self, script: tuple[str, ...] = DEFAULT_SCRIPT, time_to_first_token: float = 0.2,
+                 token_interval: float = 0.01, answer_tokens: int = 40):
+        self.script = script
+        self.time_to_first_token = time_to_first_token
+        self.token_interval = token_interval
+        self.answer_tokens = answer_tokens
+        self.counters = {"completions": 0, "tool_calls": 0, "answers": 0}
+
+        self.app = web.Application()
+        self.app.router.add_post("/v1/chat/completions", self.completions)
+        self.app.router.add_get("/v1/models", self.models)
+
+    def next_step(self, messages: list[dict]) -> tuple[str, dict]:
+        # the step is picked by how many tool results followed the last user message
+        last_user = max((i for i, message in enumerate(messages) if message["role"] == "user"), default=0)
+        tool_messages = [message for message in messages[last_user + 1:] if message["role"] == "tool"]
+        step = self.script[min(len(tool_messages), len(self.script) - 1)]
+
+        check_in = date.today() + timedelta(days=30)
+        if step == "find_hotels":
+            return step, {"city_name": user_city(messages[last_user].get("content") or ""),
+                          "check_in_date_iso": check_in.isoformat(),
+                          "check_out_date_iso": (check_in + timedelta(days=2)).isoformat(),
+                          "adults_count": 2, "children_count": 0}
+        if step == "find_hotel_comments":
+            content = tool_messages[-1]["content"] if tool_messages else ""
+            return step, {"hotel_id": first_hotel_id(content)}
+        return "answer", {}
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.counters["completions"] += 1
+        step, arguments = self.next_step(body["messages"])
+        await asyncio.sleep(self.time_to_first_token)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if step == "answer":
+            self.counters["answers"] += 1
+            tokens = [f"token{i} " for i in range(self.answer_tokens)]
+        else:
+            self.counters["tool_calls"] += 1
+            tool_call = {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                         "function": {"name": step, "arguments": json.dumps(arguments)}}
+
+        if not body.get("stream"):
+            if step == "answer":
+                await asyncio.sleep(self.token_interval * len(tokens))
+                message = {"role": "assistant", "content": "".join(tokens)}
+            else:
+                message = {"role": "assistant", "content": None, "tool_calls": [tool_call]}
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": message,
+                             "finish_reason": "stop" if step == "answer" else "tool_calls"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(delta: dict, finish_reason: str | None = None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model"),
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await send({"role": "assistant", "content": ""})
+        if step == "answer":
+            for token in tokens:
+                await send({"content": token})
+                await asyncio.sleep(self.token_interval)
+            await send({}, "stop")
+        else:
+            await send({"tool_calls": [{"index": 0, **tool_call}]})
+            await send({}, "tool_calls")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "fake", "object": "model"}]})
+
+
+async def start_fake_llm(host: str = "127.0.0.1", port: int = 8901, **options) -> tuple[web.AppRunner, FakeLLM]:
+    fake_llm = FakeLLM(**options)
+    runner = web.AppRunner(fake_llm.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner, fake_llm
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible endpoint that answers with scripted tool calls")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--script", default=",".join(DEFAULT_SCRIPT),
+                        help="comma separated tool calls of one chat turn, ending with answer")
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between streamed tokens")
+    args = parser.parse_args()
+
+    runner, _ = await start_fake_llm(args.host, args.port, script=tuple(args.script.split(",")),
+                                     time_to_first_token=args.ttft, token_interval=args.token_interval)
+    print(f"fake LLM listening on http://{args.host}:{args.port}/v1")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import weakref
+import zlib
+
+from aiohttp import web
+
+BLOCKED_PAGE = "<html><body><div id=\"captcha\">Please verify you are a human</div></body></html>"
+COMMENT_TEXTS = [
+    "Great location, friendly staff and a clean room",
+    "Breakfast was tasty but the room was small and noisy",
+    "Good value for money, comfortable bed, slow wifi",
+    "Dirty bathroom and rude reception, would not recommend",
+    "Spacious room with a nice view, quiet at night",
+]
+
+
+def stable_hash(*parts) -> int:
+    return zlib.crc32(":".join(str(part) for part in parts).encode())
+
+
+def build_hotel(city_code: int, index: int, check_in: str) -> dict:
+    hotel_id = city_code * 1000 + index
+    # prices move with the stay dates so flexible-date search and the monitor see differences
+    price = 40 + stable_hash(hotel_id, check_in) % 400
+    return {
+        "hotelBasicInfo": {
+            "hotelId": hotel_id,
+            "hotelName": f"Hotel {index} \"Grand\" {{{city_code}}}",
+            "hotelAddress": f"{index} Abay Avenue",
+            "priceExplanation": f"Total ${price:,} for all nights",
+            "images": [f"https://ak-d.tripcdn.com/images/{hotel_id}_{j}.jpg" for j in range(20)],
+        },
+        "hotelStarInfo": {"star": index % 5 + 1},
+        "commentInfo": {"commentScore": f"{6 + stable_hash(hotel_id) % 40 / 10:.1f}",
+                        "commenterNumber": f"{stable_hash(hotel_id, 'reviews') % 3000} reviews"},
+        "roomTags": {"advantageTags": [{"tagTitle": "Free cancellation"}, {"tagTitle": "Breakfast"}]},
+        "positionInfo": {"coordinate": {"lat": 43.2, "lng": 76.9}, "poi": ["[nearby]"] * 10},
+    }
+
+
+def build_list_page(hotel_list: list[dict], padding_kb: int) -> str:
+    ibu_hotel = {
+        "seo": {"links": [{"title": f"Hotels in city {i}", "url": f"/hotels/city-{i}"} for i in range(200)]},
+        "initData": {
+            "firstPageList": {"hotelList": hotel_list, "hotelTotalCount": 1200},
+            "filters": [{"id": i, "title": f"filter {i}", "children": list(range(20))} for i in range(500)],
+        },
+        "translations": {f"key_{i}": "[{0}] of {1} hotels" for i in range(2000)},
+    }
+    padding = "<div class=\"noise\">" + "x" * (padding_kb * 1024) + "</div>"
+    return (f"<html><head><script>{padding}</script><script>window.IBU_HOTEL={json.dumps(ibu_hotel)};"
+            f"</script></head><body>{padding}</body></html>")
+
+
+class FakeTrip:
+    def __init__(self, fixtures_dir: str | None = None, latency: float = 0.05, jitter: float = 0.02,
+                 error_rate: float = 0.0, block_rate: float = 0.0, page_size: int = 30, padding_kb: int = 1500,
+                 comments_count: int = 120, connect_latency: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.block_rate = block_rate
+        self.page_size = page_size
+        self.padding_kb = padding_kb
+        self.comments_count = comments_count
+        self.connect_latency = connect_latency
+        self.random = random.Random(seed)
+        self.fixtures = self._load_fixtures(fixtures_dir)
+        self.counters: dict[str, int] = {}
+        self._connections: weakref.WeakSet = weakref.WeakSet()
+
+        self.app = web.Application(middlewares=[self._inject_faults])
+        self.app.router.add_post("/htls/getKeyWordSearch", self.keyword_search)
+        self.app.router.add_get("/", self.home)
+        self.app.router.add_get("/hotels/list", self.hotels_list)
+        self.app.router.add_post("/restapi/soa2/34951/fetchHotelList", self.hotels_page)
+        self.app.router.add_post("/restapi/soa2/28820/ctgetHotelComment", self.comments)
+        self.app.router.add_get("/stats", self.stats)
+
+    @staticmethod
+    def _load_fixtures(fixtures_dir: str | None) -> dict[str, str]:
+        # recorded responses, named after the endpoint they replace, take precedence over generated ones
+        fixtures = {}
+        if fixtures_dir:
+            for name in ("getKeyWordSearch.json", "hotels_list.html", "fetchHotelList.json",
+                         "ctgetHotelComment.json"):
+                path = os.path.join(fixtures_dir, name)
+                if os.path.exists(path):
+                    with open(path, "r", encoding="utf-8") as f:
+                        fixtures[name] = f.read()
+        return fixtures
+
+    @web.middleware
+    async def _inject_faults(self, request: web.Request, handler):
+        self.counters[request.path] = self.counters.get(request.path, 0) + 1
+        if request.path == "/stats":
+            return await handler(request)
+
+        # the first request on a connection also pays for the TCP and TLS handshakes a real upstream would need
+        if request.transport is not None and request.transport not in self._connections:
+            self._connections.add(request.transport)
+            self.counters["connections"] = self.counters.get("connections", 0) + 1
+            await asyncio.sleep(self.connect_latency)
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+        roll = self.random.random()
+        if roll < self.error_rate:
+            return web.Response(status=500, text="Internal Server Error")
+        if roll < self.error_rate + self.block_rate:
+            return web.Response(text=BLOCKED_PAGE, content_type="text/html")
+        return await handler(request)
+
+    async def home(self, request: web.Request) -> web.Response:
+        return web.Response(text="<html><body>trip.com</body></html>", content_type="text/html")
+
+    async def keyword_search(self, request: web.Request) -> web.Response:
+        if "getKeyWordSearch.json" in self.fixtures:
+            return web.Response(text=self.fixtures["getKeyWordSearch.json"], content_type="application/json")
+
+        keyword = (await request.json()).get("keyWord", "")
+        city_code = 1 + stable_hash(keyword.strip().casefold()) % 5000
+        return web.json_response({"keyWordSearchResults": [
+            {"city": {"enusName": keyword.strip().title() or "Almaty", "geoCode": city_code}}
+        ]})
+
+    async def hotels_list(self, request: web.Request) -> web.Response:
+        if "hotels_list.html" in self.fixtures:
+            return web.Response(text=self.fixtures["hotels_list.html"], content_type="text/html")
+
+        city_code = int(request.query.get("city", 1))
+        check_in = request.query.get("checkin", "")
+        hotel_list = [build_hotel(city_code, i, check_in) for i in range(self.page_size)]
+        return web.Response(text=build_list_page(hotel_list, self.padding_kb), content_type="text/html")
+
+    async def hotels_page(self, request: web.Request) -> web.Response:
+        if "fetchHotelList.json" in self.fixtures:
+            return web.Response(text=self.fixtures["fetchHotelList.json"], content_type="application/json")
+
+        payload = await request.json()
+        city_code = payload["destination"]["geo"]["cityId"]
+        check_in = payload["date"]["dateInfo"]["checkInDate"]
+        page_index = payload["paging"]["pageIndex"]
+        page_size = payload["paging"]["pageSize"]
+        start = (page_index - 1) * page_size
+        return web.json_response({"data": {"hotelList": [
+            build_hotel(city_code, i, check_in) for i in range(start, start + page_size)
+        ]}})
+
+    async def comments(self, request: web.Request) -> web.Response:
+        if "ctgetHotelComment.json" in self.fixtures:
+            return web.Response(text=self.fixtures["ctgetHotelComment.json"], content_type="application/json")
+
+        payload = await request.json()
+        hotel_id = payload["hotelId"]
+        page_index = payload["pageIndex"]
+        page_size = payload["pageSize"]
+        start = (page_index - 1) * page_size
+        comment_list = [{
+            "id": hotel_id * 10000 + i,
+            "content": COMMENT_TEXTS[stable_hash(hotel_id, i) % len(COMMENT_TEXTS)],
+            "rating": 1 + stable_hash(hotel_id, i, "rating") % 10,
+            "createDate": f"/Date({1700000000000 + i * 86400000}+0800)/",
+        } for i in range(start, min(start + page_size, self.comments_count))]
+        return web.json_response({"data": {"commentList": comment_list, "totalCount": self.comments_count}})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.counters)
+
+
+async def start_fake_trip(host: str = "127.0.0.1", port: int = 8900, **options) -> tuple[web.AppRunner, FakeTrip]:
+    fake_trip = FakeTrip(**options)
+    runner = web.AppRunner(fake_trip.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner, fake_trip
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the trip.com endpoints hotels_api calls")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--fixtures", help="directory with recorded responses")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="latency standard deviation in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--block-rate", type=float, default=0.0, help="share of requests answered with a captcha")
+    parser.add_argument("--connect-latency", type=float, default=0.0,
+                        help="extra latency of the first request on a new connection")
+    args = parser.parse_args()
+
+    runner, _ = await start_fake_trip(args.host, args.port, fixtures_dir=args.fixtures, latency=args.latency,
+                                      jitter=args.jitter, error_rate=args.error_rate, block_rate=args.block_rate,
+                                      connect_latency=args.connect_latency)
+    print(f"fake trip.com listening on http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import aiohttp
+
+from benchmarks.fake_llm import start_fake_llm
+from benchmarks.fake_trip import start_fake_trip
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("search-city", "find-hotels", "comments", "chat")
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+async def wait_until_up(session: aiohttp.ClientSession, url: str, process: subprocess.Popen | None,
+                        timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise Exception(f"{url} exited with code {process.returncode}")
+        with contextlib.suppress(aiohttp.ClientError):
+            async with session.get(url) as response:
+                if response.status < 500:
+                    return
+        await asyncio.sleep(0.2)
+    raise Exception(f"{url} did not come up in {timeout}s")
+
+
+def spawn(module: str, cwd: str, port: int, env: dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], cwd=cwd, env={**os.environ, **env})
+
+
+async def run_scenario(name: str, request, requests_count: int, concurrency: int) -> dict[str, object]:
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < requests_count:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                await request(index)
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"  {name} request {index} failed: {e!r}")
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests_count,
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def scenario_requests(session: aiohttp.ClientSession, hotels_url: str, chat_url: str, distinct_keys: int):
+    check_in = date.today() + timedelta(days=30)
+
+    async def search_city(index: int):
+        async with session.get(f"{hotels_url}/search-city", params={"city": f"City {index % distinct_keys}"}) as r:
+            r.raise_for_status()
+            await r.read()
+
+    async def find_hotels(index: int):
+        stay_start = check_in + timedelta(days=index % distinct_keys)
+        async with session.get(f"{hotels_url}/find-hotels-of-city", params={
+            "cityId": 1 + index % 7, "cityName": "Almaty", "checkInDate": stay_start.isoformat(),
+            "checkOutDate": (stay_start + timedelta(days=2)).isoformat(), "adultsCount": 2, "childrenCount": 0,
+        }) as r:
+            r.raise_for_status()
+            await r.read()
+
+    async def comments(index: int):
+        async with session.get(f"{hotels_url}/get-comments-by-hotel",
+                               params={"hotelId": 1000 + index % distinct_keys}) as r:
+            r.raise_for_status()
+            await r.read()
+
+    async def chat(index: int):
+        async with session.ws_connect(f"{chat_url.replace('http', 'ws', 1)}/ws/chat") as websocket:
+            await websocket.send_json({"message": f"Find hotels in City {index % distinct_keys}"})
+            async for message in websocket:
+                data = json.loads(message.data)
+                if data["type"] == "error":
+                    raise Exception(data["error"])
+                if data["type"] == "ai_message_end" and data.get("final"):
+                    return
+            raise Exception("websocket closed before the final answer")
+
+    return {"search-city": search_city, "find-hotels": find_hotels, "comments": comments, "chat": chat}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="End to end load test of hotels_api and chat_api against local "
+                                                 "stand-ins for trip.com and the LLM")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--distinct-keys", type=int, default=50,
+                        help="distinct cities/dates/hotels per scenario, lower means more cache hits")
+    parser.add_argument("--trip-latency", type=float, default=0.05)
+    parser.add_argument("--trip-jitter", type=float, default=0.02)
+    parser.add_argument("--trip-error-rate", type=float, default=0.0)
+    parser.add_argument("--trip-block-rate", type=float, default=0.0)
+    parser.add_argument("--llm-ttft", type=float, default=0.2)
+    parser.add_argument("--llm-token-interval", type=float, default=0.01)
+    parser.add_argument("--fixtures", help="directory with recorded trip.com responses")
+    parser.add_argument("--hotels-url", help="use an already running hotels_api instead of starting one")
+    parser.add_argument("--chat-url", help="use an already running chat_api instead of starting one")
+    parser.add_argument("--base-port", type=int, default=8900)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    trip_port, llm_port, hotels_port, chat_port = range(args.base_port, args.base_port + 4)
+    trip_runner, fake_trip = await start_fake_trip(port=trip_port, fixtures_dir=args.fixtures,
+                                                   latency=args.trip_latency, jitter=args.trip_jitter,
+                                                   error_rate=args.trip_error_rate,
+                                                   block_rate=args.trip_block_rate)
+    llm_runner, fake_llm = await start_fake_llm(port=llm_port, time_to_first_token=args.llm_ttft,
+                                                token_interval=args.llm_token_interval)
+
+    processes = []
+    state_dir = tempfile.TemporaryDirectory()
+    hotels_url = args.hotels_url or f"http://127.0.0.1:{hotels_port}"
+    chat_url = args.chat_url or f"http://127.0.0.1:{chat_port}"
+    if not args.hotels_url:
+        processes.append(spawn("app:app", os.path.join(BACKEND_DIR, "hotels_api"), hotels_port, {
+            "TRIP_BASE_URL": f"http://127.0.0.1:{trip_port}",
+            "CITY_CACHE_PATH": os.path.join(state_dir.name, "city_cache.sqlite3"),
+            "MONITOR_DB_PATH": os.path.join(state_dir.name, "monitor.sqlite3"),
+        }))
+    if not args.chat_url:
+        processes.append(spawn("main_backend:app", os.path.join(BACKEND_DIR, "chat_api"), chat_port, {
+            "HOTELS_API_URL": hotels_url,
+            "LLM_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+            "LLM_MODEL": "fake",
+        }))
+
+    results = []
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as session:
+            await wait_until_up(session, f"{hotels_url}/ready", processes[0] if not args.hotels_url else None)
+            await wait_until_up(session, f"{chat_url}/", processes[-1] if not args.chat_url else None)
+
+            requests = scenario_requests(session, hotels_url, chat_url, args.distinct_keys)
+            for name in args.scenarios.split(","):
+                print(f"running {name}: {args.requests} requests, concurrency {args.concurrency}")
+                results.append(await run_scenario(name, requests[name], args.requests, args.concurrency))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                process.wait(timeout=10)
+        await llm_runner.cleanup()
+        await trip_runner.cleanup()
+        state_dir.cleanup()
+
+    print(f"\n{'scenario':<14}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['scenario']:<14}{result['requests']:>10}{result['errors']:>8}{result['throughput']:>10}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}")
+    print(f"\nupstream requests: {fake_trip.counters}")
+    print(f"llm: {fake_llm.counters}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": vars(args), "results": results, "upstream": fake_trip.counters,
+                       "llm": fake_llm.counters}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+import json
+import os
+from typing import Any, List
+
+from langchain.schema import HumanMessage
+from langchain.schema.messages import BaseMessage, ToolMessage
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 6000))
+HISTORY_RECENT_TURNS = int(os.environ.get("HISTORY_RECENT_TURNS", 2))
+COMPACTED_PREFIX = "[earlier result"
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    # roughly four characters per token is close enough for budgeting without loading a tokenizer
+    size = len(message.content) if isinstance(message.content, str) else len(json.dumps(message.content))
+    for tool_call in message.additional_kwargs.get("tool_calls", []):
+        size += len(tool_call.get("function", {}).get("arguments") or "")
+    return size // 4 + 4
+
+
+def summarize_tool_payload(content: str, max_items: int = 10, max_chars: int = 400) -> str:
+    try:
+        payload = json.loads(content)
+    except ValueError:
+        payload = None
+
+    if isinstance(payload, list) and payload and all(isinstance(item, dict) for item in payload):
+        if "hotelId" in payload[0]:
+            hotels = "; ".join(f"{hotel.get('hotelId')} {hotel.get('hotelName')} {hotel.get('totalPrice')}"
+                               for hotel in payload[:max_items])
+            return f"{COMPACTED_PREFIX}, {len(payload)} hotels (id name price): {hotels}]"
+        if "rating" in payload[0]:
+            ratings = [item["rating"] for item in payload if isinstance(item.get("rating"), (int, float))]
+            average = f"{sum(ratings) / len(ratings):.1f}" if ratings else "n/a"
+            return f"{COMPACTED_PREFIX}, {len(payload)} comments, average rating {average}]"
+
+    if len(content) <= max_chars:
+        return content
+    return f"{COMPACTED_PREFIX}, truncated] {content[:max_chars]}..."
+
+
+class ChatHistory:
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET, recent_turns: int = HISTORY_RECENT_TURNS):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.messages: List[BaseMessage] = []
+        self.tokens: List[int] = []
+        self.total_tokens = 0
+
+    def append(self, message: BaseMessage):
+        self.messages.append(message)
+        self.tokens.append(estimate_tokens(message))
+        self.total_tokens += self.tokens[-1]
+
+    def extend(self, messages: List[BaseMessage]):
+        for message in messages:
+            self.append(message)
+
+    def for_llm(self) -> List[BaseMessage]:
+        if self.total_tokens > self.token_budget:
+            self.compact()
+        return self.messages
+
+    def compact(self):
+        turn_starts = [i for i, message in enumerate(self.messages) if isinstance(message, HumanMessage)]
+        if len(turn_starts) <= self.recent_turns:
+            return
+        recent_start = turn_starts[-self.recent_turns] if self.recent_turns else len(self.messages)
+
+        # first shrink tool payloads of older turns, they are what makes the history grow
+        for i in range(recent_start):
+            message = self.messages[i]
+            if isinstance(message, ToolMessage) and not message.content.startswith(COMPACTED_PREFIX):
+                summary = summarize_tool_payload(message.content)
+                if summary != message.content:
+                    self._replace(i, ToolMessage(content=summary, tool_call_id=message.tool_call_id))
+
+        # then drop whole turns from the start, so tool calls always stay next to their results
+        while self.total_tokens > self.token_budget:
+            turn_starts = [i for i, message in enumerate(self.messages) if isinstance(message, HumanMessage)]
+            if len(turn_starts) <= max(self.recent_turns, 1):
+                break
+            start, end = turn_starts[0], turn_starts[1]
+            self.total_tokens -= sum(self.tokens[start:end])
+            del self.messages[start:end]
+            del self.tokens[start:end]
+
+    def stats(self) -> dict[str, Any]:
+        return {"messages": len(self.messages), "tokens": self.total_tokens, "budget": self.token_budget}
+
+    def _replace(self, index: int, message: BaseMessage):
+        self.total_tokens -= self.tokens[index]
+        self.messages[index] = message
+        self.tokens[index] = estimate_tokens(message)
+        self.total_tokens += self.tokens[index]
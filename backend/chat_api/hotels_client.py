@@ -0,0 +1,198 @@
+import json
+import os
+import sys
+from typing import Any, AsyncIterator, Dict, List
+
+import aiohttp
+import msgspec
+
+import metrics
+
+HOTELS_API_URL = os.environ.get("HOTELS_API_URL", "http://192.168.1.2:8000")
+HOTELS_API_MODE = os.environ.get("HOTELS_API_MODE", "http")
+HOTELS_API_DIR = os.environ.get("HOTELS_API_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hotels_api"))
+
+
+def hotels_query_params(max_price: float | None = None, min_stars: float | None = None,
+                        min_score: float | None = None, sort_by: str | None = None,
+                        top_k: int | None = None) -> Dict[str, Any]:
+    params = {"maxPrice": max_price, "minStars": min_stars, "minScore": min_score, "topK": top_k}
+    if sort_by in ("price", "stars", "score", "reviews"):
+        params["sortBy"] = sort_by
+        # cheapest first, highest rated first
+        params["order"] = "asc" if sort_by == "price" else "desc"
+    return {key: value for key, value in params.items() if value is not None}
+
+
+class HttpHotelsClient:
+    def __init__(self, base_url: str = HOTELS_API_URL, limit: int = 100, keepalive_timeout: float = 60,
+                 request_timeout: float = 120):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.session: aiohttp.ClientSession | None = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit,
+                                         keepalive_timeout=self.keepalive_timeout, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(base_url=self.base_url, connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                                             trace_configs=[metrics.http_trace_config()])
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def search_city(self, city_name: str) -> Dict[str, Any]:
+        async with self.session.get("/search-city", params={"city": city_name}) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def find_hotels(self, city_id: int, city_name: str, check_in_date: str, check_out_date: str,
+                          adults_count: int, children_count: int, **query) -> str:
+        params = {"cityId": city_id, "cityName": city_name, "checkInDate": check_in_date,
+                  "checkOutDate": check_out_date, "adultsCount": adults_count, "childrenCount": children_count}
+        params.update(hotels_query_params(**query))
+
+        async with self.session.get("/find-hotels-of-city", params=params) as response:
+            return await response.text()
+
+    async def find_hotels_flexible_dates(self, city_id: int, city_name: str, date_from: str, date_to: str, nights: int,
+                                         adults_count: int, children_count: int,
+                                         weekdays: List[int] | None = None, top_k: int = 10) -> str:
+        params = {"cityId": city_id, "cityName": city_name, "dateFrom": date_from, "dateTo": date_to,
+                  "nights": nights, "adultsCount": adults_count, "childrenCount": children_count, "topK": top_k,
+                  "includeMatrix": "false"}
+        if weekdays:
+            params["weekdays"] = ",".join(str(day) for day in weekdays)
+
+        async with self.session.get("/find-hotels-flexible-dates", params=params) as response:
+            return await response.text()
+
+    async def find_comments(self, hotel_id: int) -> str:
+        async with self.session.get("/get-comments-by-hotel", params={"hotelId": hotel_id}) as response:
+            return await response.text()
+
+    async def get_comment_digest(self, hotel_id: int) -> str:
+        async with self.session.get("/get-comment-digest", params={"hotelId": hotel_id}) as response:
+            return await response.text()
+
+    async def create_watch(self, watch: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.session.post("/watches", json=watch) as response:
+            if response.status >= 400:
+                raise Exception(await response.text())
+            return await response.json()
+
+    async def list_watches(self, owner: str) -> List[Dict[str, Any]]:
+        async with self.session.get("/watches", params={"owner": owner}) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def delete_watch(self, watch_id: int) -> bool:
+        async with self.session.delete(f"/watches/{watch_id}") as response:
+            return response.status == 200
+
+    async def iter_watch_events(self) -> AsyncIterator[Dict[str, Any]]:
+        # the event feed stays open indefinitely, so it must not inherit the per-request timeout
+        async with self.session.get("/watches/events", timeout=aiohttp.ClientTimeout(total=None)) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class InProcessHotelsClient:
+    def __init__(self, hotels_api_dir: str = HOTELS_API_DIR):
+        self.hotels_api_dir = os.path.abspath(hotels_api_dir)
+        self.hotels_manager = None
+        self.digest_manager = None
+        self.price_monitor = None
+
+    async def start(self):
+        if self.hotels_api_dir not in sys.path:
+            sys.path.insert(0, self.hotels_api_dir)
+
+        from src.managers import digest_manager, hotels_manager, rnet_manager
+        from src.managers.cache_manager import city_cache
+        from src.managers.monitor_manager import price_monitor
+
+        city_cache.open()
+        await rnet_manager.start_pool()
+        await price_monitor.start()
+        self.hotels_manager = hotels_manager
+        self.digest_manager = digest_manager
+        self.price_monitor = price_monitor
+
+    async def close(self):
+        from src.managers import rnet_manager
+        from src.managers.cache_manager import city_cache
+
+        await self.price_monitor.close()
+        await rnet_manager.close_pool()
+        city_cache.close()
+
+    async def search_city(self, city_name: str) -> Dict[str, Any]:
+        city_id, city_name = await self.hotels_manager.get_city(city_name)
+        return {"cityId": city_id, "cityName": city_name}
+
+    async def find_hotels(self, city_id: int, city_name: str, check_in_date: str, check_out_date: str,
+                          adults_count: int, children_count: int, **query) -> str:
+        from src.managers.query_manager import query_hotels
+
+        hotels = await self.hotels_manager.get_hotel_table(city_code=city_id, city_name=city_name,
+                                                           check_in_date=check_in_date,
+                                                           check_out_date=check_out_date,
+                                                           adults_count=adults_count,
+                                                           children_count=children_count)
+        params = hotels_query_params(**query)
+        hotels = query_hotels(hotels, min_price=None, max_price=params.get("maxPrice"),
+                              min_stars=params.get("minStars"), min_score=params.get("minScore"),
+                              sort_by=params.get("sortBy"), descending=params.get("order") == "desc",
+                              top_k=params.get("topK"))
+        # same text the http client gets, encoded straight from the hotel structs
+        return msgspec.json.encode(hotels).decode()
+
+    async def find_hotels_flexible_dates(self, city_id: int, city_name: str, date_from: str, date_to: str, nights: int,
+                                         adults_count: int, children_count: int,
+                                         weekdays: List[int] | None = None, top_k: int = 10) -> Dict[str, Any]:
+        from src.managers.flex_manager import get_price_matrix
+
+        return await get_price_matrix(city_code=city_id, city_name=city_name, window_start=date_from,
+                                      window_end=date_to, nights=nights, adults_count=adults_count,
+                                      children_count=children_count, weekdays=set(weekdays) if weekdays else None,
+                                      cheapest_count=top_k, include_matrix=False)
+
+    async def find_comments(self, hotel_id: int) -> str:
+        return msgspec.json.encode(await self.hotels_manager.find_comments(hotel_id)).decode()
+
+    async def get_comment_digest(self, hotel_id: int) -> Dict[str, Any]:
+        return await self.digest_manager.get_comment_digest(hotel_id)
+
+    async def create_watch(self, watch: Dict[str, Any]) -> Dict[str, Any]:
+        return self.price_monitor.add_watch(city_code=watch["cityId"], city_name=watch["cityName"],
+                                            check_in_date=watch["checkInDate"], check_out_date=watch["checkOutDate"],
+                                            adults_count=watch["adultsCount"], children_count=watch["childrenCount"],
+                                            owner=watch.get("owner"), hotel_id=watch.get("hotelId"),
+                                            max_price=watch.get("maxPrice"))
+
+    async def list_watches(self, owner: str) -> List[Dict[str, Any]]:
+        return self.price_monitor.list_watches(owner)
+
+    async def delete_watch(self, watch_id: int) -> bool:
+        return self.price_monitor.remove_watch(watch_id)
+
+    async def iter_watch_events(self) -> AsyncIterator[Dict[str, Any]]:
+        async with self.price_monitor.subscribe() as queue:
+            while True:
+                yield await queue.get()
+
+
+def create_hotels_client() -> HttpHotelsClient | InProcessHotelsClient:
+    if HOTELS_API_MODE == "inprocess":
+        return InProcessHotelsClient()
+    return HttpHotelsClient()
+
+
+hotels_client = create_hotels_client()
@@ -1,5 +1,5 @@
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-import aiohttp
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
 from langchain.schema.messages import ToolMessage
@@ -7,12 +7,39 @@ from langchain.tools import StructuredTool
 from typing import Optional, List, Dict, Any
 import asyncio
 import json
+import logging
+import os
+import time
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import uvicorn
 from pydantic import BaseModel
+import metrics
+from hotels_client import hotels_client
+from session_manager import current_session, session_manager
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "http://192.168.1.2:1234/v1")
+LLM_MODEL = os.environ.get("LLM_MODEL", "hermes-2-pro-mistral-7b")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await hotels_client.start()
+    llm = ChatOpenAI(temperature=0, base_url=LLM_BASE_URL, api_key="a", model=LLM_MODEL)
+    await session_manager.start(llm, create_tools())
+    watch_events = asyncio.create_task(forward_watch_events())
+    yield
+    watch_events.cancel()
+    await asyncio.gather(watch_events, return_exceptions=True)
+    await session_manager.close()
+    await hotels_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,163 +51,245 @@ app.add_middleware(
 )
 
 async def find_hotels(city_name: str, check_in_date_iso: str, check_out_date_iso: str, adults_count: int,
-                      children_count: int) -> str:
-    async with aiohttp.request("GET", "http://192.168.1.2:8000/search-city", params={"city": city_name}) as response:
-        response_json = await response.json()
+                      children_count: int, max_price: Optional[float] = None, min_stars: Optional[float] = None,
+                      min_score: Optional[float] = None, sort_by: Optional[str] = "score", top_k: int = 5) -> str:
+    city = await hotels_client.search_city(city_name)
+
+    return await hotels_client.find_hotels(city["cityId"], city["cityName"], check_in_date_iso, check_out_date_iso,
+                                           adults_count, children_count, max_price=max_price, min_stars=min_stars,
+                                           min_score=min_score, sort_by=sort_by, top_k=top_k)
 
-    city_id = response_json["cityId"]
-    city_name = response_json["cityName"]
+async def find_hotels_flexible_dates(city_name: str, earliest_check_in_date_iso: str, latest_check_out_date_iso: str,
+                                     nights: int, adults_count: int, children_count: int,
+                                     check_in_weekdays: Optional[List[int]] = None, top_k: int = 10) -> str:
+    city = await hotels_client.search_city(city_name)
 
-    async with aiohttp.request("GET", "http://192.168.1.2:8000/find-hotels-of-city", params={"cityId": city_id, "cityName": city_name,
-                                                                                        "checkInDate": check_in_date_iso,
-                                                                                        "checkOutDate": check_out_date_iso,
-                                                                                        "adultsCount": adults_count,
-                                                                                        "childrenCount": children_count}) as response:
-        return await response.text()
+    return await hotels_client.find_hotels_flexible_dates(city["cityId"], city["cityName"], earliest_check_in_date_iso,
+                                                          latest_check_out_date_iso, nights, adults_count,
+                                                          children_count, check_in_weekdays, top_k)
 
 async def find_hotel_comments(hotel_id: int) -> str:
-    async with aiohttp.request("GET", "http://192.168.1.2:8000/get-comments-by-hotel", params={"hotelId": hotel_id}) as response:
-        return await response.text()
+    return await hotels_client.get_comment_digest(hotel_id)
+
+async def watch_hotel_prices(city_name: str, check_in_date_iso: str, check_out_date_iso: str, adults_count: int,
+                             children_count: int, hotel_id: Optional[int] = None,
+                             max_price: Optional[float] = None) -> Dict[str, Any]:
+    city = await hotels_client.search_city(city_name)
+    session = current_session.get()
+
+    return await hotels_client.create_watch({"cityId": city["cityId"], "cityName": city["cityName"],
+                                             "checkInDate": check_in_date_iso, "checkOutDate": check_out_date_iso,
+                                             "adultsCount": adults_count, "childrenCount": children_count,
+                                             "hotelId": hotel_id, "maxPrice": max_price,
+                                             "owner": session.client_id if session else None})
+
+async def list_price_watches() -> List[Dict[str, Any]]:
+    session = current_session.get()
+    return await hotels_client.list_watches(session.client_id) if session else []
+
+async def stop_price_watch(watch_id: int) -> str:
+    session = current_session.get()
+    watches = await hotels_client.list_watches(session.client_id) if session else []
+    if not any(watch["watchId"] == watch_id for watch in watches):
+        return f"No watch {watch_id} in this chat"
+    await hotels_client.delete_watch(watch_id)
+    return f"Stopped watch {watch_id}"
 
 async def get_current_datetime():
     return datetime.now().astimezone().replace(microsecond=0).isoformat()
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+async def run_tool_call(tool_call: Dict[str, Any], tools_map: Dict[str, StructuredTool], websocket: WebSocket,
+                        semaphore: asyncio.Semaphore) -> ToolMessage:
+    tool_name = tool_call.get('function', {}).get('name')
+
+    if tool_name not in tools_map:
+        error_msg = f"Error: Tool '{tool_name}' not found"
+
+        # Notify client about error
+        await session_manager.send_message(
+            {"type": "tool_error", "name": tool_name, "error": error_msg},
+            websocket
+        )
+        return ToolMessage(content=error_msg, tool_call_id=tool_call.get('id'))
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    async with semaphore:
+        # Notify client about tool execution
+        await session_manager.send_message(
+            {"type": "tool_start", "name": tool_name},
+            websocket
+        )
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        try:
+            # Parse arguments and execute the tool
+            args = json.loads(tool_call.get('function', {}).get('arguments') or '{}')
+            with metrics.span(f"tool.{tool_name}"):
+                tool_result = await tools_map[tool_name].ainvoke(args)
+        except Exception as e:
+            metrics.TOOL_CALLS.labels(tool_name, "error").inc()
+            error_msg = f"Error: Tool '{tool_name}' failed: {e}"
+            await session_manager.send_message(
+                {"type": "tool_error", "name": tool_name, "error": error_msg},
+                websocket
+            )
+            return ToolMessage(content=error_msg, tool_call_id=tool_call.get('id'))
 
-    async def send_message(self, message: Dict[str, Any], websocket: WebSocket):
-        await websocket.send_json(message)
+    metrics.TOOL_CALLS.labels(tool_name, "ok").inc()
 
+    # Notify client about tool result
+    await session_manager.send_message(
+        {"type": "tool_result", "name": tool_name, "result": tool_result},
+        websocket
+    )
 
-manager = ConnectionManager()
+    return ToolMessage(
+        content=json.dumps(tool_result) if isinstance(tool_result, (dict, list)) else str(tool_result),
+        tool_call_id=tool_call.get('id')
+    )
 
 
-@app.websocket("/ws/chat")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    
-    # Initialize the language model
-    llm = ChatOpenAI(temperature=0, base_url="http://192.168.1.2:1234/v1", api_key="a", model="hermes-2-pro-mistral-7b")
+async def forward_watch_events(retry_delay: float = 5):
+    # one feed for the whole process, events are routed to the client that created the watch
+    while True:
+        try:
+            async for event in hotels_client.iter_watch_events():
+                if event.get("owner"):
+                    await session_manager.deliver(event["owner"], event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("watch event feed failed, reconnecting: %s", e)
+        await asyncio.sleep(retry_delay)
+
 
-    # Create tools
-    tools = [
+def create_tools() -> List[StructuredTool]:
+    return [
         StructuredTool.from_function(
-            func=find_hotels,
+            coroutine=find_hotels,
             name="find_hotels",
-            description="Find hotels in a city for given dates and number of guests"
+            description="Find hotels in a city for given dates and number of guests. Optionally filter by max_price (USD), "
+                        "min_stars and min_score, sort_by one of price/stars/score/reviews (price ascending, the others "
+                        "descending) and return only the top_k hotels"
+        ),
+        StructuredTool.from_function(
+            coroutine=find_hotels_flexible_dates,
+            name="find_hotels_flexible_dates",
+            description="Find the cheapest hotels and dates for a stay of a given number of nights anywhere inside a date "
+                        "window, e.g. the cheapest weekend in June. Optionally restrict check_in_weekdays (0 is Monday, "
+                        "4 is Friday). Use this instead of calling find_hotels once per date"
+        ),
+        StructuredTool.from_function(
+            coroutine=watch_hotel_prices,
+            name="watch_hotel_prices",
+            description="Monitor hotel prices in a city for given dates in the background and notify this chat when they "
+                        "change. Pass hotel_id to watch a single hotel and max_price (USD) to only be alerted when a "
+                        "price is or drops below it"
         ),
         StructuredTool.from_function(
-            func=get_current_datetime,
+            coroutine=list_price_watches,
+            name="list_price_watches",
+            description="List the price watches created in this chat"
+        ),
+        StructuredTool.from_function(
+            coroutine=stop_price_watch,
+            name="stop_price_watch",
+            description="Stop a price watch of this chat by its watch id"
+        ),
+        StructuredTool.from_function(
+            coroutine=get_current_datetime,
             name="get_current_datetime",
             description="Get current local datetime"
         ),
         StructuredTool.from_function(
-            func=find_hotel_comments,
+            coroutine=find_hotel_comments,
             name="find_hotel_comments",
-            description="Find comments of hotel by its id"
+            description="Summarize the reviews of a hotel by its id: rating histogram, mean, recency-weighted score and most praised/criticized aspects"
         ),
     ]
-    tools_map = {tool.name: tool for tool in tools}
 
-    # Bind the tools to the language model
-    llm_with_tools = llm.bind_tools(tools)
 
-    # Initialize conversation history
-    messages = []
+@app.websocket("/ws/chat")
+async def websocket_endpoint(websocket: WebSocket, clientId: Optional[str] = None):
+    session = await session_manager.connect(websocket, clientId)
+    if session is None:
+        return
+
+    # The language model and bound tools are shared by all sessions, history is per session
+    llm_with_tools = session_manager.llm_with_tools
+    tools_map = session_manager.tools_map
+    history = session.history
+    current_session.set(session)
     
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_json()
             user_input = data.get("message", "")
+            session.touch()
             
-            # Add user message to history
-            messages.append(HumanMessage(content=user_input))
+            with metrics.track_turn(session.session_id):
+                # Add user message to history
+                history.append(HumanMessage(content=user_input))
             
-            # Send acknowledgment of user message
-            await manager.send_message(
-                {"type": "user_message", "content": user_input}, 
-                websocket
-            )
+                # Send acknowledgment of user message
+                await session_manager.send_message(
+                    {"type": "user_message", "content": user_input}, 
+                    websocket
+                )
             
-            # Process with LLM and handle tool calls until we get a final response
-            while True:
-                # Get LLM response
-                llm_response = await llm_with_tools.ainvoke(messages)
-                
-                # Check for tool calls
-                tool_calls = llm_response.additional_kwargs.get('tool_calls', [])
-                
-                # If no tool calls, we have our final response
-                if not tool_calls:
-                    await manager.send_message(
-                        {"type": "ai_message", "content": llm_response.content},
-                        websocket
-                    )
-                    messages.append(llm_response)
-                    break
-                
-                # Process each tool call
-                messages.append(llm_response)
-                
-                for tool_call in tool_calls:
-                    tool_name = tool_call.get('function', {}).get('name')
-                    
-                    # Notify client about tool execution
-                    await manager.send_message(
-                        {"type": "tool_start", "name": tool_name},
-                        websocket
-                    )
-                    
-                    if tool_name in tools_map:
-                        tool = tools_map[tool_name]
-                        
-                        # Parse arguments
-                        args_str = tool_call.get('function', {}).get('arguments', '{}')
-                        args = json.loads(args_str)
-                        
-                        # Execute the tool
-                        tool_result = await tool.invoke(args)
-                        
-                        # Notify client about tool result
-                        await manager.send_message(
-                            {"type": "tool_result", "name": tool_name, "result": tool_result},
-                            websocket
-                        )
-                        
-                        # Add tool result to message history
-                        tool_message = ToolMessage(
-                            content=json.dumps(tool_result) if isinstance(tool_result, (dict, list)) else str(tool_result),
-                            tool_call_id=tool_call.get('id')
-                        )
-                        messages.append(tool_message)
-                    else:
-                        error_msg = f"Error: Tool '{tool_name}' not found"
-                        
-                        # Notify client about error
-                        await manager.send_message(
-                            {"type": "tool_error", "name": tool_name, "error": error_msg},
+                # Process with LLM and handle tool calls until we get a final response
+                while True:
+                    # Stream the LLM response, forwarding text as it arrives and assembling tool call fragments
+                    queued = time.perf_counter()
+                    async with session_manager.llm_slot(session):
+                        metrics.observe("llm_queue", time.perf_counter() - queued)
+                        generation_started = time.perf_counter()
+                        time_to_first_token = None
+                        llm_response = None
+                        async for chunk in llm_with_tools.astream(history.for_llm()):
+                            llm_response = chunk if llm_response is None else llm_response + chunk
+                            if chunk.content:
+                                if time_to_first_token is None:
+                                    time_to_first_token = time.perf_counter() - generation_started
+                                    metrics.observe("llm_ttft", time_to_first_token)
+                                await session_manager.send_message(
+                                    {"type": "ai_message_delta", "content": chunk.content},
+                                    websocket
+                                )
+
+                        metrics.observe("llm", time.perf_counter() - generation_started)
+
+                    if llm_response is None:
+                        llm_response = AIMessage(content="")
+
+                    # Check for tool calls
+                    tool_calls = llm_response.additional_kwargs.get('tool_calls', [])
+                    logger.info("llm generation: time to first token %s, total %.3fs, %d tool calls",
+                                "n/a" if time_to_first_token is None else f"{time_to_first_token:.3f}s",
+                                time.perf_counter() - generation_started, len(tool_calls))
+
+                    if llm_response.content or not tool_calls:
+                        await session_manager.send_message(
+                            {"type": "ai_message_end", "content": llm_response.content, "final": not tool_calls},
                             websocket
                         )
-                        
-                        # Add error message as tool result
-                        tool_message = ToolMessage(
-                            content=error_msg,
-                            tool_call_id=tool_call.get('id')
-                        )
-                        messages.append(tool_message)
+
+                    # If no tool calls, we have our final response
+                    if not tool_calls:
+                        history.append(llm_response)
+                        break
+                
+                    # Run every tool call of this response concurrently, keeping results in tool_call_id order
+                    history.append(llm_response)
+                    tool_messages = await asyncio.gather(*(
+                        run_tool_call(tool_call, tools_map, websocket, session.tool_semaphore) for tool_call in tool_calls
+                    ))
+                    history.extend(tool_messages)
     
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        session_manager.disconnect(session)
 
 
 @app.get("/")
@@ -188,6 +297,16 @@ async def root():
     return {"message": "Hotel Chat API is running"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/sessions")
+async def sessions_stats():
+    return session_manager.stats()
+
+
 if __name__ == "__main__":
     uvicorn.run("weather:app", host="0.0.0.0", port=8080, reload=True)
 
@@ -0,0 +1,102 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextvars import ContextVar
+
+import aiohttp
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SLOW_TURN_SECONDS = float(os.environ.get("SLOW_TURN_SECONDS", 15))
+REQUEST_ID_HEADER = "X-Request-ID"
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+TURN_SECONDS = Histogram("chat_api_turn_seconds", "Time from a user message to the final answer",
+                         ["outcome"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("chat_api_stage_seconds", "Time spent in one stage of a chat turn",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+TOOL_CALLS = Counter("chat_api_tool_calls_total", "Tool calls by tool and outcome", ["tool", "outcome"])
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+# (stage, seconds) of every span finished during the current chat turn
+request_spans: ContextVar[list[tuple[str, float]] | None] = ContextVar("request_spans", default=None)
+
+NUMERIC_SEGMENT_PATTERN = re.compile(r"/\d+")
+
+
+def observe(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    spans = request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def track_turn(session_id: str):
+    current_id = uuid.uuid4().hex
+    spans = []
+    id_token = request_id.set(current_id)
+    spans_token = request_spans.set(spans)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield current_id
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        TURN_SECONDS.labels(outcome).observe(elapsed)
+        if elapsed >= SLOW_TURN_SECONDS:
+            logger.warning("slow chat turn %s", json.dumps({
+                "requestId": current_id,
+                "sessionId": session_id,
+                "outcome": outcome,
+                "seconds": round(elapsed, 3),
+                "stages": breakdown(spans),
+            }))
+        request_spans.reset(spans_token)
+        request_id.reset(id_token)
+
+
+def breakdown(spans: list[tuple[str, float]]) -> dict[str, dict[str, float]]:
+    # tool calls run concurrently, so the stage totals can add up to more than the turn took
+    stages = {}
+    for stage, seconds in spans:
+        entry = stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+    return {stage: {"count": entry["count"], "seconds": round(entry["seconds"], 3)}
+            for stage, entry in sorted(stages.items(), key=lambda item: -item[1]["seconds"])}
+
+
+def http_trace_config() -> aiohttp.TraceConfig:
+    # propagates the turn's request id to hotels_api and times every call made through the session
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+        current_id = request_id.get()
+        if current_id is not None:
+            params.headers[REQUEST_ID_HEADER] = current_id
+
+    async def on_request_end(session, context, params):
+        observe("hotels_api" + NUMERIC_SEGMENT_PATTERN.sub("/{id}", params.url.path),
+                time.perf_counter() - context.started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_end)
+    return trace_config
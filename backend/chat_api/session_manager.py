@@ -0,0 +1,177 @@
+import asyncio
+import contextlib
+import os
+import re
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List
+
+from fastapi import WebSocket
+from langchain.tools import StructuredTool
+
+from history_manager import ChatHistory
+
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 1000))
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 4))
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", 1800))
+TOOL_CONCURRENCY = int(os.environ.get("TOOL_CONCURRENCY", 4))
+CLIENT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{8,64}")
+
+# set by the websocket handler, so shared tools can tell which session called them
+current_session: ContextVar["Session | None"] = ContextVar("current_session", default=None)
+
+
+class Session:
+    def __init__(self, websocket: WebSocket, client_id: str):
+        self.session_id = uuid.uuid4().hex
+        # outlives the connection: the browser keeps it and sends it again on reconnect, watches belong to it
+        self.client_id = client_id
+        self.websocket = websocket
+        self.history = ChatHistory()
+        self.tool_semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+
+class SessionManager:
+    def __init__(self, max_sessions: int = MAX_SESSIONS, llm_concurrency: int = LLM_CONCURRENCY,
+                 idle_timeout: float = SESSION_IDLE_TIMEOUT, sweep_interval: float = 60):
+        self.max_sessions = max_sessions
+        self.llm_concurrency = llm_concurrency
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+
+        self.sessions: Dict[str, Session] = {}
+        self.clients: Dict[str, set[Session]] = {}
+        self.llm_with_tools = None
+        self.tools_map: Dict[str, StructuredTool] = {}
+
+        self._llm_active = 0
+        self._llm_waiters: deque[tuple[Session, asyncio.Future]] = deque()
+        self._background: set[asyncio.Task] = set()
+        self._sweeper: asyncio.Task | None = None
+
+    async def start(self, llm, tools: List[StructuredTool]):
+        self.tools_map = {tool.name: tool for tool in tools}
+        self.llm_with_tools = llm.bind_tools(tools)
+        self._sweeper = asyncio.create_task(self._evict_idle())
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._sweeper
+            self._sweeper = None
+        for session in list(self.sessions.values()):
+            with contextlib.suppress(Exception):
+                await session.websocket.close(code=1001)
+        self.sessions.clear()
+        self.clients.clear()
+
+    async def connect(self, websocket: WebSocket, client_id: str | None = None) -> Session | None:
+        await websocket.accept()
+        if len(self.sessions) >= self.max_sessions:
+            await websocket.send_json({"type": "error", "error": "Too many active sessions, try again later"})
+            await websocket.close(code=1013)
+            return None
+
+        if client_id is None or not CLIENT_ID_PATTERN.fullmatch(client_id):
+            client_id = uuid.uuid4().hex
+        session = Session(websocket, client_id)
+        self.sessions[session.session_id] = session
+        self.clients.setdefault(client_id, set()).add(session)
+        await self.send_message({"type": "session", "sessionId": session.session_id, "clientId": client_id},
+                                websocket)
+        return session
+
+    def disconnect(self, session: Session):
+        self.sessions.pop(session.session_id, None)
+        sessions = self.clients.get(session.client_id)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del self.clients[session.client_id]
+
+    async def send_message(self, message: Dict[str, Any], websocket: WebSocket):
+        await websocket.send_json(message)
+
+    async def deliver(self, client_id: str, message: Dict[str, Any]) -> bool:
+        # every open tab of the client gets it, a client that is offline can read the watch's changes later
+        sessions = self.clients.get(client_id)
+        if not sessions:
+            return False
+        for session in list(sessions):
+            await self._send_quietly(message, session.websocket)
+        return True
+
+    @contextlib.asynccontextmanager
+    async def llm_slot(self, session: Session):
+        if self._llm_active < self.llm_concurrency and not self._llm_waiters:
+            self._llm_active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._llm_waiters.append((session, waiter))
+            self._notify_queue_positions()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # cancelling the task cancels the waiter too, only a waiter with a result was handed a slot
+                if waiter.done() and not waiter.cancelled():
+                    # the slot was already handed over to us, pass it on
+                    self._release_llm_slot()
+                elif (session, waiter) in self._llm_waiters:
+                    self._llm_waiters.remove((session, waiter))
+                    self._notify_queue_positions()
+                raise
+
+        try:
+            yield
+        finally:
+            session.touch()
+            self._release_llm_slot()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self.sessions),
+            "maxSessions": self.max_sessions,
+            "llmActive": self._llm_active,
+            "llmQueued": len(self._llm_waiters),
+        }
+
+    def _release_llm_slot(self):
+        while self._llm_waiters:
+            _, waiter = self._llm_waiters.popleft()
+            if not waiter.done():
+                # hand the slot straight to the next session instead of releasing it
+                waiter.set_result(None)
+                self._notify_queue_positions()
+                return
+        self._llm_active -= 1
+
+    def _notify_queue_positions(self):
+        for position, (session, _) in enumerate(self._llm_waiters, start=1):
+            task = asyncio.create_task(self._send_quietly(
+                {"type": "queue_position", "position": position}, session.websocket
+            ))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _send_quietly(self, message: Dict[str, Any], websocket: WebSocket):
+        with contextlib.suppress(Exception):
+            await self.send_message(message, websocket)
+
+    async def _evict_idle(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            deadline = time.monotonic() - self.idle_timeout
+            for session in [session for session in self.sessions.values() if session.last_active < deadline]:
+                self.disconnect(session)
+                with contextlib.suppress(Exception):
+                    await session.websocket.close(code=1000)
+
+
+session_manager = SessionManager()
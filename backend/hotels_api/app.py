@@ -1,9 +1,72 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 import uvicorn
-from fastapi import FastAPI, Query
-from typing import Dict
-from src.managers.hotels_manager import get_city, get_hotels_for_city, find_comments
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel
+from typing import Dict, Literal
+from src import metrics, utils
+from src.responses import FastJSONResponse, ndjson_line
+from src.managers import rnet_manager
+from src.managers.proxy_manager import proxy_scheduler, reload_proxies, watch_proxies_file, \
+    PROXIES_RELOAD_INTERVAL
+from src.managers.cache_manager import city_cache, hotels_cache, digest_cache
+from src.managers.query_manager import query_hotels, SortField
+from src.managers.monitor_manager import price_monitor
+from src.managers.warmup_manager import startup_warmup
+from src.managers.flex_manager import get_price_matrix, FLEX_CHEAPEST_COUNT
+from src.managers.digest_manager import get_comment_digest, DIGEST_COMMENTS_LIMIT
+from src.managers.hotels_manager import get_city, get_hotel_table, iter_hotels_for_city, find_comments, \
+    iter_comments, HOTELS_MAX_RESULTS, COMMENTS_LIMIT, COMMENTS_MAX_LIMIT
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    city_cache.open()
+    await rnet_manager.start_pool()
+    proxies_watcher = asyncio.create_task(watch_proxies_file()) if PROXIES_RELOAD_INTERVAL > 0 else None
+    await startup_warmup.start()
+    await price_monitor.start()
+    yield
+    await price_monitor.close()
+    await startup_warmup.close()
+    if proxies_watcher is not None:
+        proxies_watcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await proxies_watcher
+    await rnet_manager.close_pool()
+    city_cache.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# subscriptions that stay open for as long as the client listens, their duration says nothing about latency
+UNTIMED_ROUTES = {"/watches/events"}
+
+
+@app.middleware("http")
+async def track_request(request: Request, call_next):
+    with metrics.track_request(request.headers.get(metrics.REQUEST_ID_HEADER)) as tracker:
+        try:
+            response = await call_next(request)
+        except Exception:
+            tracker.finish()
+            raise
+    route = request.scope.get("route")
+    tracker.route = route.path if route is not None else "unmatched"
+    tracker.status = response.status_code
+    response.headers[metrics.REQUEST_ID_HEADER] = tracker.request_id
+    if tracker.route not in UNTIMED_ROUTES:
+        response.body_iterator = tracker.wrap_body(response.body_iterator)
+    return response
+
+
+@app.exception_handler(utils.UpstreamError)
+async def upstream_error_handler(request: Request, exc: utils.UpstreamError) -> JSONResponse:
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
 
-app = FastAPI()
 
 @app.get("/search-city")
 async def search_city(city: str = Query(..., description="Name of the city")) -> Dict[str, object]:
@@ -15,6 +78,43 @@ async def search_city(city: str = Query(..., description="Name of the city")) ->
     }
 
 
+@app.get("/cache-stats")
+async def cache_stats() -> Dict[str, object]:
+    return {
+        "city": city_cache.stats(),
+        "hotels": hotels_cache.stats(),
+        "digest": digest_cache.stats()
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/admin/proxies")
+async def admin_proxies() -> list[Dict[str, object]]:
+    return proxy_scheduler.to_list(rnet_manager.rnet_pool.stats() if rnet_manager.rnet_pool else None)
+
+
+@app.post("/admin/proxies/reload")
+async def admin_reload_proxies() -> Dict[str, object]:
+    return {
+        "reloaded": reload_proxies(),
+        "proxies": proxy_scheduler.to_list(rnet_manager.rnet_pool.stats() if rnet_manager.rnet_pool else None)
+    }
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    return JSONResponse(status_code=200 if startup_warmup.ready else 503, content=startup_warmup.to_dict())
+
+
+@app.get("/admin/hedging")
+async def admin_hedging() -> Dict[str, object]:
+    return proxy_scheduler.hedging.to_dict()
+
+
 @app.get("/find-hotels-of-city")
 async def find_hotels_of_city(cityId: int = Query(..., description="ID of the city"),
                               cityName: str = Query(..., description="Name of the city"),
@@ -22,12 +122,164 @@ async def find_hotels_of_city(cityId: int = Query(..., description="ID of the ci
                               checkOutDate: str = Query(..., description="Check out date ISO"),
                               adultsCount: int = Query(..., description="Number of adults"),
                               childrenCount: int = Query(..., description="Number of children"),
-                              ) -> list[Dict[str, object]]:
-    return await get_hotels_for_city(city_code=cityId, city_name=cityName, check_in_date=checkInDate, check_out_date=checkOutDate, adults_count=adultsCount, children_count=childrenCount)
+                              maxResults: int | None = Query(None, ge=1, description="Fetch further pages up to this many hotels"),
+                              minPrice: float | None = Query(None, description="Minimum total price in USD"),
+                              maxPrice: float | None = Query(None, description="Maximum total price in USD"),
+                              minStars: float | None = Query(None, description="Minimum number of stars"),
+                              minScore: float | None = Query(None, description="Minimum review score"),
+                              sortBy: SortField | None = Query(None, description="Field to sort by"),
+                              order: Literal["asc", "desc"] = Query("asc", description="Sort order"),
+                              topK: int | None = Query(None, ge=1, description="Return only the first K hotels"),
+                              fields: str | None = Query(None, description="Comma separated fields to return"),
+                              ) -> FastJSONResponse:
+    if maxResults is None:
+        hotels = await get_hotel_table(city_code=cityId, city_name=cityName, check_in_date=checkInDate, check_out_date=checkOutDate, adults_count=adultsCount, children_count=childrenCount)
+    else:
+        hotels = [hotel async for hotel in iter_hotels_for_city(city_code=cityId, city_name=cityName, check_in_date=checkInDate, check_out_date=checkOutDate, adults_count=adultsCount, children_count=childrenCount,
+                                                                max_results=min(maxResults, HOTELS_MAX_RESULTS))]
+
+    # returned as a response so the hotel structs skip FastAPI's validation and jsonable_encoder
+    return FastJSONResponse(query_hotels(hotels, min_price=minPrice, max_price=maxPrice, min_stars=minStars,
+                                         min_score=minScore, sort_by=sortBy, descending=order == "desc", top_k=topK,
+                                         fields=fields.split(",") if fields else None))
+
+
+@app.get("/find-hotels-flexible-dates")
+async def find_hotels_flexible_dates(cityId: int = Query(..., description="ID of the city"),
+                                     cityName: str = Query(..., description="Name of the city"),
+                                     dateFrom: str = Query(..., description="Earliest check in date ISO"),
+                                     dateTo: str = Query(..., description="Latest check out date ISO"),
+                                     nights: int = Query(..., description="Length of the stay in nights"),
+                                     adultsCount: int = Query(..., description="Number of adults"),
+                                     childrenCount: int = Query(..., description="Number of children"),
+                                     weekdays: str | None = Query(None, description="Comma separated check in weekdays, 0 is Monday"),
+                                     topK: int = Query(FLEX_CHEAPEST_COUNT, ge=1, description="Number of cheapest options"),
+                                     includeMatrix: bool = Query(True, description="Include the per hotel price matrix"),
+                                     ) -> Dict[str, object]:
+    try:
+        check_in_weekdays = {int(day) for day in weekdays.split(",")} if weekdays else None
+        return await get_price_matrix(city_code=cityId, city_name=cityName, window_start=dateFrom, window_end=dateTo,
+                                      nights=nights, adults_count=adultsCount, children_count=childrenCount,
+                                      weekdays=check_in_weekdays, cheapest_count=topK,
+                                      include_matrix=includeMatrix)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/find-hotels-of-city/stream")
+async def stream_hotels_of_city(cityId: int = Query(..., description="ID of the city"),
+                                cityName: str = Query(..., description="Name of the city"),
+                                checkInDate: str = Query(..., description="Check in date ISO"),
+                                checkOutDate: str = Query(..., description="Check out date ISO"),
+                                adultsCount: int = Query(..., description="Number of adults"),
+                                childrenCount: int = Query(..., description="Number of children"),
+                                maxResults: int = Query(HOTELS_MAX_RESULTS, ge=1, description="Maximum number of hotels"),
+                                ) -> StreamingResponse:
+    hotels = iter_hotels_for_city(city_code=cityId, city_name=cityName, check_in_date=checkInDate, check_out_date=checkOutDate, adults_count=adultsCount, children_count=childrenCount,
+                                  max_results=min(maxResults, HOTELS_MAX_RESULTS))
+
+    return StreamingResponse((ndjson_line(hotel) async for hotel in hotels), media_type="application/x-ndjson")
+
 
 @app.get("/get-comments-by-hotel")
-async def find_hotels_of_city(hotelId: int) -> list[Dict[str, object]]:
-    return await find_comments(hotelId)
+async def get_comments_by_hotel(hotelId: int,
+                                limit: int = Query(COMMENTS_LIMIT, ge=1, description="Maximum number of comments")
+                                ) -> FastJSONResponse:
+    return FastJSONResponse(await find_comments(hotelId, limit=min(limit, COMMENTS_MAX_LIMIT)))
+
+
+@app.get("/get-comments-by-hotel/stream")
+async def stream_comments_by_hotel(hotelId: int,
+                                   limit: int = Query(COMMENTS_LIMIT, ge=1, description="Maximum number of comments")
+                                   ) -> StreamingResponse:
+    comments = iter_comments(hotelId, limit=min(limit, COMMENTS_MAX_LIMIT))
+
+    return StreamingResponse((ndjson_line(comment) async for comment in comments), media_type="application/x-ndjson")
+
+
+
+@app.get("/get-comment-digest")
+async def comment_digest(hotelId: int,
+                         limit: int = Query(DIGEST_COMMENTS_LIMIT, ge=1, description="Number of comments to summarize")
+                         ) -> Dict[str, object]:
+    return await get_comment_digest(hotelId, limit=min(limit, COMMENTS_MAX_LIMIT))
+
+
+class WatchRequest(BaseModel):
+    cityId: int
+    cityName: str
+    checkInDate: str
+    checkOutDate: str
+    adultsCount: int
+    childrenCount: int
+    hotelId: int | None = None
+    maxPrice: float | None = None
+    owner: str | None = None
+
+
+@app.post("/watches")
+async def create_watch(watch: WatchRequest) -> Dict[str, object]:
+    try:
+        return price_monitor.add_watch(city_code=watch.cityId, city_name=watch.cityName,
+                                       check_in_date=watch.checkInDate, check_out_date=watch.checkOutDate,
+                                       adults_count=watch.adultsCount, children_count=watch.childrenCount,
+                                       owner=watch.owner, hotel_id=watch.hotelId, max_price=watch.maxPrice)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/watches")
+async def list_watches(owner: str | None = Query(None, description="Only watches created by this owner")
+                       ) -> list[Dict[str, object]]:
+    return price_monitor.list_watches(owner)
+
+
+@app.get("/watches/events")
+async def watch_events(owner: str | None = Query(None, description="Only events of watches created by this owner"),
+                       heartbeat: float = Query(30, gt=0, description="Seconds between keep-alive lines")
+                       ) -> StreamingResponse:
+    async def events():
+        async with price_monitor.subscribe() as queue:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield "\n"
+                    continue
+                if owner is None or event["owner"] == owner:
+                    yield ndjson_line(event)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.get("/watches/{watchId}")
+async def get_watch(watchId: int) -> Dict[str, object]:
+    watch = price_monitor.get_watch(watchId)
+    if watch is None:
+        raise HTTPException(status_code=404, detail="watch not found")
+    return watch
+
+
+@app.get("/watches/{watchId}/changes")
+async def get_watch_changes(watchId: int,
+                            limit: int = Query(50, ge=1, description="Maximum number of changes")
+                            ) -> list[Dict[str, object]]:
+    changes = price_monitor.watch_changes(watchId, limit)
+    if changes is None:
+        raise HTTPException(status_code=404, detail="watch not found")
+    return changes
+
+
+@app.delete("/watches/{watchId}")
+async def delete_watch(watchId: int) -> Dict[str, object]:
+    if not price_monitor.remove_watch(watchId):
+        raise HTTPException(status_code=404, detail="watch not found")
+    return {"watchId": watchId, "deleted": True}
+
+
+@app.get("/admin/monitor")
+async def admin_monitor() -> Dict[str, object]:
+    return price_monitor.stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import asyncio
+import contextlib
+import json
+import time
+import tracemalloc
+
+from src import utils
+
+CHUNK_SIZE = 16 * 1024
+ROUNDS = 20
+
+loop = asyncio.new_event_loop()
+
+
+def build_page(hotels_count: int = 30, padding_kb: int = 1500) -> bytes:
+    hotel_list = [
+        {
+            "hotelBasicInfo": {
+                "hotelId": 1000 + i,
+                "hotelName": f"Hotel {i} \"Grand\" {{Almaty}}",
+                "hotelAddress": f"{i} Abay Avenue, Almaty",
+                "priceExplanation": f"Total ${100 + i} for 2 nights",
+                "images": [f"https://ak-d.tripcdn.com/images/{i}_{j}.jpg" for j in range(20)],
+            },
+            "hotelStarInfo": {"star": i % 5 + 1},
+            "commentInfo": {"commentScore": "8.5", "commenterNumber": f"{i * 7} reviews"},
+            "roomTags": {"advantageTags": [{"tagTitle": "Free cancellation"}, {"tagTitle": "Breakfast"}]},
+            "positionInfo": {"coordinate": {"lat": 43.2, "lng": 76.9}, "poi": ["[nearby]"] * 10},
+        }
+        for i in range(hotels_count)
+    ]
+    ibu_hotel = {
+        "seo": {"links": [{"title": f"Hotels in city {i}", "url": f"/hotels/city-{i}"} for i in range(200)]},
+        "initData": {
+            "firstPageList": {"hotelList": hotel_list, "hotelTotalCount": 1200},
+            "filters": [{"id": i, "title": f"filter {i}", "children": list(range(20))} for i in range(500)],
+        },
+        "translations": {f"key_{i}": "[{0}] of {1} hotels" for i in range(2000)},
+    }
+    padding = "<div class=\"noise\">" + "x" * (padding_kb * 1024) + "</div>"
+    return (
+        f"<html><head><script>{padding}</script><script>window.IBU_HOTEL={json.dumps(ibu_hotel)};"
+        f"</script></head><body>{padding}</body></html>"
+    ).encode()
+
+
+def current_path(page: bytes) -> list:
+    response_text = page.decode()
+    response_text = utils.filter_string(response_text, "window.IBU_HOTEL=", end="}};", include_start=False,
+                                        include_end=True).removesuffix(";")
+    return json.loads(response_text)["initData"]["firstPageList"]["hotelList"]
+
+
+async def chunked(page: bytes):
+    for i in range(0, len(page), CHUNK_SIZE):
+        yield page[i:i + CHUNK_SIZE]
+
+
+async def extract(page: bytes) -> list:
+    async with contextlib.aclosing(chunked(page)) as chunks:
+        return await utils.extract_json_subtree(
+            chunks, "window.IBU_HOTEL=", ("initData", "firstPageList", "hotelList")
+        )
+
+
+def streaming_path(page: bytes) -> list:
+    return loop.run_until_complete(extract(page))
+
+
+def measure(name: str, func, page: bytes):
+    result = func(page)
+
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        func(page)
+    elapsed = (time.perf_counter() - started) / ROUNDS
+
+    tracemalloc.start()
+    func(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<12} {elapsed * 1000:8.2f} ms/page  peak {peak / 1024 / 1024:6.2f} MiB  hotels {len(result)}")
+    return result
+
+
+if __name__ == "__main__":
+    page = build_page()
+    print(f"page size {len(page) / 1024 / 1024:.2f} MiB, {ROUNDS} rounds")
+    expected = measure("filter_string", current_path, page)
+    actual = measure("streaming", streaming_path, page)
+    assert actual == expected
@@ -0,0 +1,113 @@
+import gc
+import json
+import re
+import time
+import tracemalloc
+from typing import Dict
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from benchmarks.ibu_hotel_extraction import build_page
+from src import schemas, utils
+from src.managers.hotels_manager import hotel_info
+from src.responses import FastJSONResponse
+
+ROUNDS = 200
+
+# what FastAPI does with a list[Dict[str, object]] return annotation before rendering
+response_model = TypeAdapter(list[Dict[str, object]])
+
+
+def legacy_hotel_info(hotel: dict) -> dict:
+    total_price = re.search(r'\$\d[\d,]*(?:\.\d+)?', hotel["hotelBasicInfo"]["priceExplanation"])
+    advantages = []
+    if hotel.get("roomTags", {}).get("advantageTags") is not None:
+        for advantage in hotel["roomTags"]["advantageTags"]:
+            advantages.append(advantage["tagTitle"])
+
+    return {
+        "hotelId": hotel["hotelBasicInfo"]["hotelId"],
+        "hotelName": hotel["hotelBasicInfo"]["hotelName"],
+        "hotelAddress": hotel["hotelBasicInfo"]["hotelAddress"],
+        "stars": hotel["hotelStarInfo"]["star"],
+        "commentsScore": hotel["commentInfo"]["commentScore"],
+        "commentsCount": hotel["commentInfo"]["commenterNumber"].removesuffix("reviews").removesuffix(" "),
+        "advantages": advantages,
+        "totalPrice": total_price.group(0) if total_price else "unavailable"
+    }
+
+
+def build_comments_page(count: int = 10) -> str:
+    return json.dumps({"ResponseStatus": {"Ack": "Success", "Extension": [{"Id": "CLOGGING_TRACE_ID"}] * 5},
+                       "data": {"totalCount": 1200, "commentList": [{
+                           "id": 9000 + i,
+                           "content": "Great location, friendly staff and a clean room. " * 8,
+                           "rating": i % 10 + 1,
+                           "createDate": f"/Date({1700000000000 + i * 86400000}+0800)/",
+                           "userInfo": {"nickName": f"user{i}", "headPictureUrl": "https://example.com/a.png",
+                                        "level": {"name": "Gold"}},
+                           "imageList": [{"url": f"https://example.com/{i}_{j}.jpg"} for j in range(6)],
+                           "translatedContent": "Great location, friendly staff and a clean room. " * 8,
+                           "roomTypeName": "Deluxe King Room",
+                       } for i in range(count)]}})
+
+
+def hotels_before(subtree: str) -> bytes:
+    hotels = [legacy_hotel_info(hotel) for hotel in json.loads(subtree)]
+    return JSONResponse(jsonable_encoder(response_model.validate_python(hotels))).body
+
+
+def hotels_after(subtree: str) -> bytes:
+    hotels = [hotel_info(hotel) for hotel in utils.decode_json(subtree, list[schemas.RawHotel])]
+    return FastJSONResponse(hotels).body
+
+
+def comments_before(page: str) -> bytes:
+    comments = [{"comment": comment["content"], "rating": comment["rating"]}
+                for comment in json.loads(page)["data"]["commentList"]]
+    return JSONResponse(jsonable_encoder(response_model.validate_python(comments))).body
+
+
+def comments_after(page: str) -> bytes:
+    comments = [schemas.Comment(comment=comment.content, rating=comment.rating)
+                for comment in utils.decode_json(page, schemas.CommentsResponse).data.commentList]
+    return FastJSONResponse(comments).body
+
+
+def measure(name: str, func, payload: str) -> bytes:
+    body = func(payload)
+
+    gc.collect()
+    started = time.process_time()
+    for _ in range(ROUNDS):
+        func(payload)
+    cpu = (time.process_time() - started) / ROUNDS
+
+    # allocations made while handling one request, whether or not they survive it
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, "traceback") if stat.count_diff > 0)
+
+    print(f"{name:<18} {cpu * 1e6:9.1f} us cpu/request  peak {peak / 1024:8.1f} KiB  "
+          f"live allocations {allocations:6d}  body {len(body)} bytes")
+    return body
+
+
+if __name__ == "__main__":
+    page = build_page().decode()
+    subtree = json.dumps(json.loads(page.split("window.IBU_HOTEL=", 1)[1].split(";</script>", 1)[0])
+                         ["initData"]["firstPageList"]["hotelList"])
+    comments_page = build_comments_page()
+
+    print(f"hotel list {len(subtree) / 1024:.1f} KiB, comments page {len(comments_page) / 1024:.1f} KiB, "
+          f"{ROUNDS} rounds")
+    assert json.loads(measure("hotels before", hotels_before, subtree)) == \
+           json.loads(measure("hotels after", hotels_after, subtree))
+    assert json.loads(measure("comments before", comments_before, comments_page)) == \
+           json.loads(measure("comments after", comments_after, comments_page))
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AsyncCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 300, stale_ttl: float = 900):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0}
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            fetched_at, value = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.counters["hits"] += 1
+                self._entries.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.counters["stale_hits"] += 1
+                self._entries.move_to_end(key)
+                if key not in self._in_flight:
+                    self.counters["refreshes"] += 1
+                    self._start_fetch(key, fetch).add_done_callback(_consume_exception)
+                return value
+            del self._entries[key]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.counters["misses"] += 1
+            task = self._start_fetch(key, fetch)
+        else:
+            self.counters["coalesced"] += 1
+
+        # shield so a disconnecting caller does not cancel the fetch the other waiters share
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, int]:
+        return {**self.counters, "size": len(self._entries), "in_flight": len(self._in_flight)}
+
+    def _start_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.ensure_future(self._fetch(key, fetch))
+        self._in_flight[key] = task
+        return task
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return value
+        finally:
+            del self._in_flight[key]
+
+
+def _consume_exception(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
+
+
+def normalize_city_query(search_str: str) -> str:
+    return re.sub(r"\s+", " ", search_str).strip().casefold()
+
+
+class CityCache:
+    def __init__(self, path: str, max_size: int = 4096, memory_ttl: float = 3600,
+                 store_ttl: float = 30 * 24 * 3600):
+        self.path = path
+        self.store_ttl = store_ttl
+        self.memory = TTLCache(max_size=max_size, ttl=memory_ttl)
+
+        self.counters = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+
+        self._connection: sqlite3.Connection | None = None
+
+    def open(self):
+        if self._connection is not None:
+            return
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS city_queries (
+                query TEXT PRIMARY KEY,
+                city_code INTEGER NOT NULL,
+                city_name TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._connection.execute("DELETE FROM city_queries WHERE updated_at < ?", (time.time() - self.store_ttl,))
+        self._connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get(self, search_str: str) -> tuple[int, str] | None:
+        # only queries trip.com already answered resolve locally, what it returns for any other string is unknown
+        self.open()
+        query = normalize_city_query(search_str)
+
+        city = self.memory.get(query)
+        if city is not None:
+            self.counters["memory_hits"] += 1
+            return city
+
+        row = self._connection.execute(
+            "SELECT city_code, city_name FROM city_queries WHERE query = ? AND updated_at >= ?",
+            (query, time.time() - self.store_ttl)
+        ).fetchone()
+        if row is not None:
+            self.counters["store_hits"] += 1
+            city = (row[0], row[1])
+            self.memory.set(query, city)
+            return city
+
+        self.counters["misses"] += 1
+        return None
+
+    def set(self, search_str: str, city: tuple[int, str]):
+        self.open()
+        query = normalize_city_query(search_str)
+        city = (int(city[0]), city[1])
+
+        self._connection.execute(
+            "INSERT OR REPLACE INTO city_queries (query, city_code, city_name, updated_at) VALUES (?, ?, ?, ?)",
+            (query, city[0], city[1], time.time())
+        )
+        self._connection.commit()
+        self.memory.set(query, city)
+
+    def stats(self) -> dict[str, int]:
+        self.open()
+        store_size = self._connection.execute("SELECT COUNT(*) FROM city_queries").fetchone()[0]
+        return {**self.counters, "memory_size": len(self.memory), "store_size": store_size}
+
+
+city_cache = CityCache(os.environ.get("CITY_CACHE_PATH",
+                                      os.path.join(os.path.dirname(os.path.dirname(__file__)), "city_cache.sqlite3")))
+hotels_cache = AsyncCache(ttl=float(os.environ.get("HOTELS_CACHE_TTL", 300)),
+                          stale_ttl=float(os.environ.get("HOTELS_CACHE_STALE_TTL", 900)))
+digest_cache = AsyncCache(ttl=float(os.environ.get("DIGEST_CACHE_TTL", 6 * 3600)),
+                          stale_ttl=float(os.environ.get("DIGEST_CACHE_STALE_TTL", 24 * 3600)))
@@ -0,0 +1,126 @@
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+
+from src import schemas, utils
+from src.managers.cache_manager import digest_cache
+from src.managers.hotels_manager import iter_raw_comments
+
+DIGEST_COMMENTS_LIMIT = 100
+# trip.com review ratings are out of 10, fixed so digests of different hotels stay comparable
+RATING_SCALE = 10
+RECENCY_HALF_LIFE_DAYS = 180
+
+ASPECTS = {
+    "cleanliness": {"clean", "dirty", "spotless", "dust", "dusty", "smell", "smelly", "stain", "stains", "hygiene"},
+    "staff": {"staff", "reception", "receptionist", "service", "friendly", "rude", "helpful", "manager"},
+    "location": {"location", "located", "central", "center", "centre", "metro", "walk", "walking", "nearby", "view"},
+    "room": {"room", "rooms", "spacious", "small", "tiny", "cramped", "furniture", "balcony"},
+    "bed": {"bed", "beds", "mattress", "pillow", "pillows", "sleep", "slept"},
+    "bathroom": {"bathroom", "shower", "toilet", "towels", "towel", "water"},
+    "breakfast": {"breakfast", "food", "restaurant", "buffet", "coffee", "delicious", "tasty"},
+    "noise": {"noise", "noisy", "quiet", "loud", "soundproof", "thin"},
+    "wifi": {"wifi", "wi-fi", "internet", "connection"},
+    "value": {"price", "value", "expensive", "cheap", "worth", "overpriced", "money"},
+    "parking": {"parking", "park", "garage"},
+    "pool": {"pool", "spa", "gym", "sauna"},
+}
+
+POSITIVE_WORDS = {
+    "good", "great", "excellent", "nice", "friendly", "clean", "comfortable", "perfect", "amazing", "helpful",
+    "quiet", "spacious", "delicious", "tasty", "lovely", "wonderful", "recommend", "beautiful", "best", "convenient",
+}
+NEGATIVE_WORDS = {
+    "bad", "dirty", "rude", "noisy", "poor", "broken", "smell", "smelly", "terrible", "awful", "old", "small",
+    "slow", "expensive", "overpriced", "cold", "uncomfortable", "worst", "disappointing", "cramped", "loud",
+}
+
+ASPECT_NAMES = list(ASPECTS)
+WORD_PATTERN = re.compile(r"[a-z][a-z'-]*")
+DATE_MILLISECONDS_PATTERN = re.compile(r"/Date\((\d+)")
+
+
+def parse_comment_date(comment: schemas.RawComment) -> float | None:
+    for key in ("createDate", "checkInDate", "publishDate"):
+        value = getattr(comment, key)
+        if not isinstance(value, str) or not value:
+            continue
+        match = DATE_MILLISECONDS_PATTERN.search(value)
+        if match:
+            return int(match.group(1)) / 1000
+        try:
+            return utils.parse_date(value).timestamp()
+        except (AttributeError, ValueError):
+            continue
+    return None
+
+
+def build_digest(hotel_id: int, comments: list[schemas.RawComment]) -> dict[str, object]:
+    ratings = np.asarray([float(comment.rating or 0) for comment in comments], dtype=np.float64)
+    rated = ratings > 0
+    ratings = ratings[rated]
+    comments = [comment for comment, has_rating in zip(comments, rated) if has_rating]
+
+    if ratings.size == 0:
+        return {"hotelId": hotel_id, "count": 0}
+
+    histogram = np.bincount(np.clip(np.rint(ratings).astype(np.int64), 1, RATING_SCALE), minlength=RATING_SCALE + 1)
+
+    # exponential decay by comment age, falling back to the order trip.com returned them in when dates are missing
+    timestamps = np.asarray([parse_comment_date(comment) or np.nan for comment in comments], dtype=np.float64)
+    if np.isnan(timestamps).all():
+        ages_days = np.arange(ratings.size, dtype=np.float64) * (RECENCY_HALF_LIFE_DAYS / max(ratings.size, 1))
+    else:
+        timestamps = np.where(np.isnan(timestamps), np.nanmin(timestamps), timestamps)
+        ages_days = np.maximum(time.time() - timestamps, 0) / 86400
+    weights = np.power(0.5, ages_days / RECENCY_HALF_LIFE_DAYS)
+
+    positive_aspects, negative_aspects = aspect_keywords(comments, ratings, RATING_SCALE)
+
+    return {
+        "hotelId": hotel_id,
+        "count": int(ratings.size),
+        "ratingScale": RATING_SCALE,
+        "mean": round(float(ratings.mean()), 2),
+        "variance": round(float(ratings.var()), 2),
+        "recencyWeightedMean": round(float(np.average(ratings, weights=weights)), 2),
+        "histogram": {str(rating): int(count) for rating, count in enumerate(histogram) if rating > 0 and count},
+        "positiveAspects": positive_aspects,
+        "negativeAspects": negative_aspects,
+        "newestComment": datetime.fromtimestamp(float(np.nanmax(timestamps))).date().isoformat()
+        if not np.isnan(timestamps).all() else None,
+    }
+
+
+def aspect_keywords(comments: list[schemas.RawComment], ratings: np.ndarray, rating_scale: int,
+                    top: int = 3) -> tuple[list[dict], list[dict]]:
+    mentions = np.zeros((len(comments), len(ASPECT_NAMES)), dtype=np.float64)
+    polarity = np.zeros(len(comments), dtype=np.float64)
+
+    for i, comment in enumerate(comments):
+        words = set(WORD_PATTERN.findall((comment.content or "").lower()))
+        polarity[i] = len(words & POSITIVE_WORDS) - len(words & NEGATIVE_WORDS)
+        for j, aspect in enumerate(ASPECT_NAMES):
+            mentions[i, j] = bool(words & ASPECTS[aspect])
+
+    # a comment's sentiment is its rating relative to the middle of the scale, nudged by lexicon hits
+    sentiment = (ratings - (rating_scale + 1) / 2) / rating_scale + 0.1 * np.clip(polarity, -3, 3)
+    mention_counts = mentions.sum(axis=0)
+    scores = sentiment @ mentions / np.maximum(mention_counts, 1)
+
+    order = np.argsort(scores)
+    positive = [{"aspect": ASPECT_NAMES[j], "mentions": int(mention_counts[j]), "score": round(float(scores[j]), 2)}
+                for j in order[::-1] if scores[j] > 0 and mention_counts[j] > 0][:top]
+    negative = [{"aspect": ASPECT_NAMES[j], "mentions": int(mention_counts[j]), "score": round(float(scores[j]), 2)}
+                for j in order if scores[j] < 0 and mention_counts[j] > 0][:top]
+    return positive, negative
+
+
+async def get_comment_digest(hotel_id: int, limit: int = DIGEST_COMMENTS_LIMIT) -> dict[str, object]:
+    async def fetch_digest():
+        comments = [comment async for comment in iter_raw_comments(hotel_id, limit, ordered=True)]
+        return build_digest(hotel_id, comments)
+
+    return await digest_cache.get_or_fetch((int(hotel_id), limit), fetch_digest)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src import utils
+from src.managers.hotels_manager import get_hotel_table
+from src.managers.query_manager import HotelTable
+from src.schemas import Hotel
+
+logger = logging.getLogger(__name__)
+
+FLEX_MAX_STAYS = int(os.environ.get("FLEX_MAX_STAYS", 31))
+FLEX_CONCURRENCY = int(os.environ.get("FLEX_CONCURRENCY", 4))
+FLEX_CHEAPEST_COUNT = 10
+
+
+def candidate_stays(window_start: datetime, window_end: datetime, nights: int,
+                    weekdays: set[int] | None = None) -> list[tuple[datetime, datetime]]:
+    if nights < 1:
+        raise ValueError("nights must be at least 1")
+
+    stays = []
+    check_in_date = window_start
+    # the whole stay has to fit inside the window
+    while check_in_date + timedelta(days=nights) <= window_end:
+        if weekdays is None or check_in_date.weekday() in weekdays:
+            stays.append((check_in_date, check_in_date + timedelta(days=nights)))
+        check_in_date += timedelta(days=1)
+
+    if len(stays) > FLEX_MAX_STAYS:
+        raise ValueError(f"date window has {len(stays)} candidate stays, at most {FLEX_MAX_STAYS} are allowed")
+    return stays
+
+
+async def get_price_matrix(city_code: int, city_name: str, window_start: str, window_end: str, nights: int,
+                           adults_count: int, children_count: int, weekdays: set[int] | None = None,
+                           cheapest_count: int = FLEX_CHEAPEST_COUNT, include_matrix: bool = True,
+                           concurrency: int = FLEX_CONCURRENCY) -> dict[str, object]:
+    stays = candidate_stays(utils.parse_date(window_start), utils.parse_date(window_end), nights, weekdays)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_stay(check_in_date: datetime, check_out_date: datetime):
+        async with semaphore:
+            return await get_hotel_table(city_code, city_name, check_in_date.date().isoformat(),
+                                         check_out_date.date().isoformat(), adults_count, children_count)
+
+    results = await asyncio.gather(*(fetch_stay(*stay) for stay in stays), return_exceptions=True)
+
+    dates, tables, failed_dates = [], [], []
+    for (check_in_date, check_out_date), result in zip(stays, results):
+        stay = {"checkIn": check_in_date.date().isoformat(), "checkOut": check_out_date.date().isoformat()}
+        if isinstance(result, BaseException):
+            logger.warning("skipping stay %s - %s in city %s: %s", stay["checkIn"], stay["checkOut"], city_code,
+                           result)
+            failed_dates.append(stay)
+            continue
+        dates.append(stay)
+        tables.append(result)
+
+    if stays and not dates:
+        raise utils.UpstreamError(f"no prices for any stay in city {city_code}")
+
+    matrix = build_price_matrix(dates, tables, failed_dates, cheapest_count)
+    if not include_matrix:
+        del matrix["hotels"]
+    return matrix
+
+
+def build_price_matrix(dates: list[dict], tables: list[HotelTable], failed_dates: list[dict],
+                       cheapest_count: int = FLEX_CHEAPEST_COUNT) -> dict[str, object]:
+    hotels: dict[int, Hotel] = {}
+    for table in tables:
+        for hotel in table.hotels:
+            hotels.setdefault(hotel.hotelId, hotel)
+    hotel_ids = list(hotels)
+    rows = {hotel_id: i for i, hotel_id in enumerate(hotel_ids)}
+
+    # hotels x stays, NaN where a hotel was not listed or had no price for that stay
+    prices = np.full((len(hotel_ids), len(dates)), np.nan)
+    for j, table in enumerate(tables):
+        prices[[rows[hotel.hotelId] for hotel in table.hotels], j] = table.columns["price"]
+
+    priced = ~np.isnan(prices)
+    flat_order = np.argsort(np.where(priced, prices, np.inf), axis=None, kind="stable")[:cheapest_count]
+    cheapest = [{
+        "hotelId": hotel_ids[i],
+        "hotelName": hotels[hotel_ids[i]].hotelName,
+        **dates[j],
+        "totalPrice": float(prices[i, j]),
+    } for i, j in zip(*np.unravel_index(flat_order, prices.shape)) if priced[i, j]]
+
+    cheapest_by_date = []
+    for j, stay in enumerate(dates):
+        if not priced[:, j].any():
+            cheapest_by_date.append({**stay, "hotelId": None, "totalPrice": None})
+            continue
+        i = int(np.nanargmin(prices[:, j]))
+        cheapest_by_date.append({**stay, "hotelId": hotel_ids[i], "hotelName": hotels[hotel_ids[i]].hotelName,
+                                 "totalPrice": float(prices[i, j])})
+
+    return {
+        "dates": dates,
+        "failedDates": failed_dates,
+        "hotels": [{
+            "hotelId": hotel_id,
+            "hotelName": hotels[hotel_id].hotelName,
+            "stars": hotels[hotel_id].stars,
+            "commentsScore": hotels[hotel_id].commentsScore,
+            "prices": [float(price) if not np.isnan(price) else None for price in prices[i]],
+        } for i, hotel_id in enumerate(hotel_ids)],
+        "cheapest": cheapest,
+        "cheapestByDate": cheapest_by_date,
+    }
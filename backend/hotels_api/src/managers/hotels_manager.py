@@ -1,101 +1,131 @@
 import asyncio
-import json
+import logging
+import os
 import random
 import re
-from src import utils
+from datetime import datetime
+from src import metrics, schemas, utils
+from src.managers.proxy_manager import proxy_scheduler
 from src.managers.rnet_manager import RnetManager
+from src.managers.cache_manager import city_cache, hotels_cache
+from src.managers.query_manager import HotelTable
 
-from selenium_driverless import webdriver
-from selenium_driverless.types.by import By
+logger = logging.getLogger(__name__)
+
+TRIP_BASE_URL = os.environ.get("TRIP_BASE_URL", "https://www.trip.com").rstrip("/")
+HOTELS_MAX_RESULTS = int(os.environ.get("HOTELS_MAX_RESULTS", 100))
+HOTELS_PAGE_CONCURRENCY = int(os.environ.get("HOTELS_PAGE_CONCURRENCY", 4))
+COMMENTS_LIMIT = 50
+COMMENTS_MAX_LIMIT = int(os.environ.get("COMMENTS_MAX_LIMIT", 200))
+COMMENTS_PAGE_SIZE = 10
+COMMENTS_PAGE_CONCURRENCY = int(os.environ.get("COMMENTS_PAGE_CONCURRENCY", 5))
 
 
 async def get_city(search_str: str) -> tuple[int, str]:
-    rnet_client = RnetManager.init_random_proxy().rnet_client
-
-    response_json = await utils.get_response_json(rnet_client.post(
-        "https://www.trip.com/htls/getKeyWordSearch",
-
-        json={
-            "code": 0,
-            "codeType": "",
-            "keyWord": search_str,
-            "searchType": "D",
-            "scenicCode": 0,
-            "cityCodeOfUser": 0,
-            "searchConditions": [
+    city = city_cache.get(search_str)
+    if city is not None:
+        return city
+
+    city = await fetch_city(search_str)
+    city_cache.set(search_str, city)
+    return city
+
+
+async def fetch_city(search_str: str) -> tuple[int, str]:
+    payload = {
+        "code": 0,
+        "codeType": "",
+        "keyWord": search_str,
+        "searchType": "D",
+        "scenicCode": 0,
+        "cityCodeOfUser": 0,
+        "searchConditions": [
+            {
+                "type": "D_PROVINCE",
+                "value": "T"
+            },
+            {
+                "type": "SupportNormalSearch",
+                "value": "T"
+            },
+            {
+                "type": "DisplayTagIcon",
+                "value": "T"
+            }
+        ],
+        "head": {
+            "platform": "PC",
+            "bu": "ibu",
+            "group": "TRIP",
+            "aid": "",
+            "sid": "",
+            "ouid": "",
+            "caid": "",
+            "csid": "",
+            "couid": "",
+            "region": "XX",
+            "locale": "en-XX",
+            "timeZone": "5",
+            "currency": "USD",
+            "pageID": "10320668148",
+            "deviceID": "PC",
+            "clientVersion": "0",
+
+            "extension": [
+                {
+                    "name": "cityId",
+                    "value": "3263"
+                },
                 {
-                    "type": "D_PROVINCE",
-                    "value": "T"
+                    "name": "checkIn",
+                    "value": "2025/06/01"
                 },
                 {
-                    "type": "SupportNormalSearch",
-                    "value": "T"
+                    "name": "checkOut",
+                    "value": "2025/06/03"
                 },
                 {
-                    "type": "DisplayTagIcon",
-                    "value": "T"
+                    "name": "region",
+                    "value": "XX"
                 }
             ],
-            "head": {
-                "platform": "PC",
-                "bu": "ibu",
-                "group": "TRIP",
-                "aid": "",
-                "sid": "",
-                "ouid": "",
-                "caid": "",
-                "csid": "",
-                "couid": "",
-                "region": "XX",
-                "locale": "en-XX",
-                "timeZone": "5",
-                "currency": "USD",
-                "pageID": "10320668148",
-                "deviceID": "PC",
-                "clientVersion": "0",
-
-                "extension": [
-                    {
-                        "name": "cityId",
-                        "value": "3263"
-                    },
-                    {
-                        "name": "checkIn",
-                        "value": "2025/06/01"
-                    },
-                    {
-                        "name": "checkOut",
-                        "value": "2025/06/03"
-                    },
-                    {
-                        "name": "region",
-                        "value": "XX"
-                    }
-                ],
-                "tripSub1": "",
-                "hotelExtension": {}}
-        }
-    ))
+            "tripSub1": "",
+            "hotelExtension": {}}
+    }
 
-    if not isinstance(response_json.get("keyWordSearchResults"), list):
-        raise Exception(f"invalid city: {response_json}")
+    response = await proxy_scheduler.run(lambda proxy_client: utils.get_response_json(
+        proxy_client.rnet_client.post(f"{TRIP_BASE_URL}/htls/getKeyWordSearch", json=payload),
+        schemas.KeyWordSearchResponse
+    ), operation="city")
 
-    if not response_json["keyWordSearchResults"]:
-        raise Exception(f"invalid city: {response_json}")
+    if not response.keyWordSearchResults:
+        raise Exception(f"invalid city: {search_str}")
 
-    city_name = response_json["keyWordSearchResults"][0]["city"]["enusName"]
-    city_code = response_json["keyWordSearchResults"][0]["city"]["geoCode"]
+    city_name = response.keyWordSearchResults[0].city.enusName
+    city_code = response.keyWordSearchResults[0].city.geoCode
 
     return city_code, city_name
 
 
 async def get_hotels_for_city(city_code: int, city_name: str, check_in_date: str, check_out_date: str,
-                              adults_count: int, children_count: int):
-    rnet_client = RnetManager.init_random_proxy().rnet_client
+                              adults_count: int, children_count: int) -> list[schemas.Hotel]:
+    table = await get_hotel_table(city_code, city_name, check_in_date, check_out_date, adults_count, children_count)
+    return table.hotels
+
 
+async def get_hotel_table(city_code: int, city_name: str, check_in_date: str, check_out_date: str,
+                          adults_count: int, children_count: int) -> HotelTable:
     check_in_date = utils.parse_date(check_in_date)
     check_out_date = utils.parse_date(check_out_date)
 
+    key = (int(city_code), check_in_date.date(), check_out_date.date(), int(adults_count), int(children_count))
+    return await hotels_cache.get_or_fetch(key, lambda: fetch_hotels_for_city(
+        city_code, city_name, check_in_date, check_out_date, adults_count, children_count
+    ))
+
+
+async def fetch_hotels_for_city(city_code: int, city_name: str, check_in_date: datetime, check_out_date: datetime,
+                                adults_count: int, children_count: int) -> HotelTable:
     params = utils.dict_to_query_params({
         "city": city_code,
         "cityName": city_name,
@@ -107,93 +137,257 @@ async def get_hotels_for_city(city_code: int, city_name: str, check_in_date: str
         "adult": adults_count,
         "children": children_count,
     })
-    response = await rnet_client.get("https://www.trip.com/hotels/list", query=params)
-    response_text = await response.text()
 
-    response_text = utils.filter_string(response_text, "window.IBU_HOTEL=", end="}};", include_start=False,
-                                        include_end=True).removesuffix(";")
+    async def fetch_hotel_list(proxy_client: RnetManager):
+        response = await proxy_client.rnet_client.get(f"{TRIP_BASE_URL}/hotels/list", query=params)
+        async with response.stream() as streamer:
+            return await utils.extract_json_subtree(streamer, "window.IBU_HOTEL=",
+                                                    ("initData", "firstPageList", "hotelList"),
+                                                    list[schemas.RawHotel])
+
+    hotel_list = await proxy_scheduler.run(fetch_hotel_list, operation="hotels")
+
+    with metrics.span("transform"):
+        return HotelTable([hotel_info(hotel) for hotel in hotel_list])
+
+
+async def fetch_hotels_page(city_code: int, check_in_date: datetime, check_out_date: datetime, adults_count: int,
+                            children_count: int, page_index: int, page_size: int):
+    payload = {
+        "date": {
+            "dateType": 1,
+            "dateInfo": {
+                "checkInDate": check_in_date.strftime("%Y%m%d"),
+                "checkOutDate": check_out_date.strftime("%Y%m%d")
+            }
+        },
+        "destination": {
+            "type": 1,
+            "geo": {
+                "cityId": int(city_code),
+                "countryId": 0
+            },
+            "keyword": {
+                "word": ""
+            }
+        },
+        "roomQuantity": 1,
+        "adultCount": int(adults_count),
+        "childCount": int(children_count),
+        "paging": {
+            "pageIndex": page_index,
+            "pageSize": page_size,
+            "pageCode": "10320668148"
+        },
+        "head": {
+            "platform": "PC",
+            "bu": "ibu",
+            "group": "TRIP",
+            "locale": "en-XX",
+            "timeZone": "5",
+            "currency": "USD",
+            "pageID": "10320668148",
+            "deviceID": "PC",
+            "clientVersion": "0"
+        }
+    }
+
+    response = await proxy_scheduler.run(lambda proxy_client: utils.get_response_json(
+        proxy_client.rnet_client.post(f"{TRIP_BASE_URL}/restapi/soa2/34951/fetchHotelList", json=payload),
+        schemas.HotelsPageResponse
+    ), operation="hotels_page")
+
+    if response.data is None or response.data.hotelList is None:
+        raise Exception(f"invalid hotels page {page_index} of city {city_code}")
+
+    with metrics.span("transform"):
+        return [hotel_info(hotel) for hotel in response.data.hotelList]
+
+
+async def iter_hotels_for_city(city_code: int, city_name: str, check_in_date: str, check_out_date: str,
+                               adults_count: int, children_count: int, max_results: int = HOTELS_MAX_RESULTS,
+                               concurrency: int = HOTELS_PAGE_CONCURRENCY):
+    first_page = await get_hotels_for_city(city_code, city_name, check_in_date, check_out_date, adults_count,
+                                           children_count)
+
+    seen_hotel_ids = set()
+    for hotel in first_page[:max_results]:
+        seen_hotel_ids.add(hotel.hotelId)
+        yield hotel
+
+    page_size = len(first_page)
+    if page_size == 0 or len(seen_hotel_ids) >= max_results:
+        return
+
+    check_in_date = utils.parse_date(check_in_date)
+    check_out_date = utils.parse_date(check_out_date)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_page(page_index: int):
+        async with semaphore:
+            return await fetch_hotels_page(city_code, check_in_date, check_out_date, adults_count, children_count,
+                                           page_index, page_size)
 
+    pages_count = -(-max_results // page_size)
+    tasks = [asyncio.ensure_future(fetch_page(page_index)) for page_index in range(2, pages_count + 1)]
     try:
-        response_json = json.loads(response_text)
-    except:
-        raise Exception(f"json decode error: {response_text}")
-
-    hotels_info = []
-
-    for hotel in response_json["initData"]["firstPageList"]["hotelList"]:
-
-        total_price = hotel["hotelBasicInfo"]["priceExplanation"]
-
-        total_price = re.search(r'\$\d+', total_price)
-
-        if total_price is None:
-            total_price = "unavailable"
-        else:
-            total_price = total_price.group(0)
-
-        advantages = []
-        if hotel.get("roomTags", {}).get("advantageTags") is not None:
-            for advantage in hotel["roomTags"]["advantageTags"]:
-                advantages.append(advantage["tagTitle"])
-
-        hotels_info.append({
-            "hotelId": hotel["hotelBasicInfo"]["hotelId"],
-            "hotelName": hotel["hotelBasicInfo"]["hotelName"],
-            "hotelAddress": hotel["hotelBasicInfo"]["hotelAddress"],
-            "stars": hotel["hotelStarInfo"]["star"],
-            "commentsScore": hotel["commentInfo"]["commentScore"],
-            "commentsCount": hotel["commentInfo"]["commenterNumber"].removesuffix("reviews").removesuffix(" "),
-            "advantages": advantages,
-            "totalPrice": total_price
-        })
-    return hotels_info
-
-
-async def find_comments(hotel_id: int):
-    rnet_client = RnetManager.init_random_proxy().rnet_client
-
-    comments = []
-    while len(comments) < 50:
-        response_json = await utils.get_response_json(
-            rnet_client.post("https://www.trip.com/restapi/soa2/28820/ctgetHotelComment", json={
-                "hotelId": int(hotel_id),
-                "pageIndex": 1,
-                "pageSize": 10,
-                "repeatComment": 1,
-                "needStaticInfo": False,
-                "functionOptions": [
-                    "IntegratedTARating",
-                    "hidePicAndVideoAgg",
-                    "TripReviewsToServerOnline",
-                    "IntegratedExpediaList",
-                    "tripShuffled",
-                    "taAdvisorCount",
-                    "filterComment",
-                    "noShowNewExpedia"
-                ],
-                "head": {
-                    "platform": "PC",
-                    "cver": "0",
-                    "bu": "IBU",
-                    "group": "trip",
-                    "aid": "",
-                    "sid": "",
-                    "ouid": "",
-                    "locale": "en-XX",
-                    "timezone": "5",
-                    "currency": "USD",
-                    "pageId": "10320668147"
-                }
-            }))
-        new_comms = [{"comment": comment["content"], "rating": comment["rating"]} for comment in response_json["data"]["commentList"]]
-        comments.extend(new_comms)
-        if len(new_comms) < 10:
-            break
-        return comments
+        for task in asyncio.as_completed(tasks):
+            try:
+                page = await task
+            except Exception as e:
+                logger.warning("skipping hotels page of city %s: %s", city_code, e)
+                continue
+            for hotel in page:
+                if hotel.hotelId in seen_hotel_ids:
+                    continue
+                seen_hotel_ids.add(hotel.hotelId)
+                yield hotel
+                if len(seen_hotel_ids) >= max_results:
+                    return
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def hotel_info(hotel: schemas.RawHotel) -> schemas.Hotel:
+    total_price = hotel.hotelBasicInfo.priceExplanation
+
+    total_price = re.search(r'\$\d[\d,]*(?:\.\d+)?', total_price or "")
+
+    if total_price is None:
+        total_price = "unavailable"
+    else:
+        total_price = total_price.group(0)
+
+    advantages = []
+    if hotel.roomTags is not None and hotel.roomTags.advantageTags is not None:
+        for advantage in hotel.roomTags.advantageTags:
+            if advantage.tagTitle is not None:
+                advantages.append(advantage.tagTitle)
+
+    return schemas.Hotel(
+        hotelId=hotel.hotelBasicInfo.hotelId,
+        hotelName=hotel.hotelBasicInfo.hotelName,
+        hotelAddress=hotel.hotelBasicInfo.hotelAddress or "",
+        stars=hotel.hotelStarInfo.star or 0,
+        commentsScore=hotel.commentInfo.commentScore,
+        commentsCount=(hotel.commentInfo.commenterNumber or "").removesuffix("reviews").removesuffix(" "),
+        advantages=advantages,
+        totalPrice=total_price
+    )
+
+
+async def find_comments(hotel_id: int, limit: int = COMMENTS_LIMIT):
+    return [comment async for comment in iter_comments(hotel_id, limit, ordered=True)]
+
+
+async def iter_comments(hotel_id: int, limit: int = COMMENTS_LIMIT, ordered: bool = False):
+    async for comment in iter_raw_comments(hotel_id, limit, ordered):
+        yield schemas.Comment(comment=comment.content or "", rating=comment.rating or 0)
+
+
+async def iter_raw_comments(hotel_id: int, limit: int = COMMENTS_LIMIT, ordered: bool = False,
+                            concurrency: int = COMMENTS_PAGE_CONCURRENCY):
+    if limit <= 0:
+        return
+
+    first_page, total_count = await fetch_comments_page(hotel_id, 1)
+
+    seen_comments = set()
 
+    def is_new(comment: schemas.RawComment) -> bool:
+        key = comment.id or (comment.content, comment.rating)
+        if key in seen_comments:
+            return False
+        seen_comments.add(key)
+        return True
+
+    for comment in first_page:
+        if is_new(comment):
+            yield comment
+            if len(seen_comments) >= limit:
+                return
+
+    if len(first_page) < COMMENTS_PAGE_SIZE:
+        return
+
+    pages_count = -(-limit // COMMENTS_PAGE_SIZE)
+    if total_count is not None:
+        pages_count = min(pages_count, -(-total_count // COMMENTS_PAGE_SIZE))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_page(page_index: int):
+        async with semaphore:
+            comments, _ = await fetch_comments_page(hotel_id, page_index)
+            return comments
+
+    tasks = [asyncio.ensure_future(fetch_page(page_index)) for page_index in range(2, pages_count + 1)]
+    try:
+        for task in (tasks if ordered else asyncio.as_completed(tasks)):
+            try:
+                page = await task
+            except Exception as e:
+                logger.warning("skipping comments page of hotel %s: %s", hotel_id, e)
+                continue
+            for comment in page:
+                if is_new(comment):
+                    yield comment
+                    if len(seen_comments) >= limit:
+                        return
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_comments_page(hotel_id: int, page_index: int) -> tuple[list[schemas.RawComment], int | None]:
+    payload = {
+        "hotelId": int(hotel_id),
+        "pageIndex": page_index,
+        "pageSize": COMMENTS_PAGE_SIZE,
+        "repeatComment": 1,
+        "needStaticInfo": False,
+        "functionOptions": [
+            "IntegratedTARating",
+            "hidePicAndVideoAgg",
+            "TripReviewsToServerOnline",
+            "IntegratedExpediaList",
+            "tripShuffled",
+            "taAdvisorCount",
+            "filterComment",
+            "noShowNewExpedia"
+        ],
+        "head": {
+            "platform": "PC",
+            "cver": "0",
+            "bu": "IBU",
+            "group": "trip",
+            "aid": "",
+            "sid": "",
+            "ouid": "",
+            "locale": "en-XX",
+            "timezone": "5",
+            "currency": "USD",
+            "pageId": "10320668147"
+        }
+    }
+
+    response = await proxy_scheduler.run(lambda proxy_client: utils.get_response_json(
+        proxy_client.rnet_client.post(f"{TRIP_BASE_URL}/restapi/soa2/28820/ctgetHotelComment", json=payload),
+        schemas.CommentsResponse
+    ), operation="comments")
+
+    if response.data is None or response.data.commentList is None:
+        raise Exception(f"invalid comments page {page_index} of hotel {hotel_id}")
+
+    return response.data.commentList, response.data.totalCount
 
 
 # async def book_hotel(hotel_id: str, check_in_date: str, check_out_date: str, adults_count: int, children_count: int, first_name: str, last_name: str, email: str, card_number: str, card_cvv: str, card_expiration: str):
+#     # imported here, selenium_driverless alone takes most of the service's import time
+#     from selenium_driverless import webdriver
+#     from selenium_driverless.types.by import By
+#
 #     async with webdriver.Chrome() as driver:
 #         await driver.get(f"https://www.trip.com/hotels/detail?cityId=39&hotelId={hotel_id}&checkIn={check_in_date}&checkOut={check_out_date}&adult={adults_count}&children={children_count}&curr=USD&display=exavg&barcurr=USD&locale=en-XX", timeout=60)
 #         await driver.find_element(By.XPATH, "//span[text()='Reserve']", timeout=60)
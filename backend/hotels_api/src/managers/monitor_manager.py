@@ -0,0 +1,418 @@
+import asyncio
+import contextlib
+import heapq
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+from datetime import date
+
+from src import utils
+from src.managers.hotels_manager import get_hotels_for_city
+from src.managers.query_manager import parse_number
+from src.schemas import Hotel
+
+logger = logging.getLogger(__name__)
+
+MONITOR_DB_PATH = os.environ.get("MONITOR_DB_PATH",
+                                 os.path.join(os.path.dirname(os.path.dirname(__file__)), "monitor.sqlite3"))
+MONITOR_MIN_INTERVAL = float(os.environ.get("MONITOR_MIN_INTERVAL", 300))
+MONITOR_MAX_INTERVAL = float(os.environ.get("MONITOR_MAX_INTERVAL", 6 * 3600))
+MONITOR_CONCURRENCY = int(os.environ.get("MONITOR_CONCURRENCY", 4))
+MONITOR_EVENT_QUEUE_SIZE = 1000
+
+
+def group_key(city_code: int, check_in_date: str, check_out_date: str, adults_count: int, children_count: int) -> str:
+    return f"{int(city_code)}:{check_in_date}:{check_out_date}:{int(adults_count)}:{int(children_count)}"
+
+
+def price_snapshot(hotels: list[Hotel]) -> dict[str, dict]:
+    snapshot = {}
+    for hotel in hotels:
+        price = parse_number(hotel.totalPrice)
+        snapshot[str(hotel.hotelId)] = {"name": hotel.hotelName,
+                                        "price": None if math.isnan(price) else price}
+    return snapshot
+
+
+def diff_snapshots(old: dict[str, dict], new: dict[str, dict]) -> dict[str, dict]:
+    diff = {}
+    for hotel_id in old.keys() | new.keys():
+        old_price = old[hotel_id]["price"] if hotel_id in old else None
+        new_price = new[hotel_id]["price"] if hotel_id in new else None
+        if old_price != new_price:
+            name = (new.get(hotel_id) or old[hotel_id])["name"]
+            diff[hotel_id] = {"name": name, "old": old_price, "new": new_price}
+    return diff
+
+
+class MonitorStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+
+    def open(self):
+        if self._connection is not None:
+            return
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS watch_groups (
+                key TEXT PRIMARY KEY,
+                city_code INTEGER NOT NULL,
+                city_name TEXT NOT NULL,
+                check_in_date TEXT NOT NULL,
+                check_out_date TEXT NOT NULL,
+                adults_count INTEGER NOT NULL,
+                children_count INTEGER NOT NULL,
+                interval REAL NOT NULL,
+                next_run REAL NOT NULL,
+                snapshot TEXT,
+                checked_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS watches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_key TEXT NOT NULL,
+                owner TEXT,
+                hotel_id INTEGER,
+                max_price REAL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS watches_group_key ON watches (group_key);
+            CREATE TABLE IF NOT EXISTS price_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_key TEXT NOT NULL,
+                changed_at REAL NOT NULL,
+                diff TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS price_changes_group_key ON price_changes (group_key, changed_at);
+        """)
+        self._connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def add_watch(self, key: str, city_code: int, city_name: str, check_in_date: str, check_out_date: str,
+                  adults_count: int, children_count: int, owner: str | None, hotel_id: int | None,
+                  max_price: float | None, interval: float) -> tuple[dict, bool]:
+        now = time.time()
+        created = self._connection.execute(
+            "INSERT OR IGNORE INTO watch_groups (key, city_code, city_name, check_in_date, check_out_date, "
+            "adults_count, children_count, interval, next_run) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, city_code, city_name, check_in_date, check_out_date, adults_count, children_count, interval, now)
+        ).rowcount > 0
+        watch_id = self._connection.execute(
+            "INSERT INTO watches (group_key, owner, hotel_id, max_price, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, owner, hotel_id, max_price, now)
+        ).lastrowid
+        self._connection.commit()
+        return self.get_watch(watch_id), created
+
+    def get_watch(self, watch_id: int) -> dict | None:
+        row = self._connection.execute(
+            "SELECT w.id, w.group_key, w.owner, w.hotel_id, w.max_price, w.created_at, g.city_code, g.city_name, "
+            "g.check_in_date, g.check_out_date, g.adults_count, g.children_count, g.checked_at "
+            "FROM watches w JOIN watch_groups g ON g.key = w.group_key WHERE w.id = ?", (watch_id,)
+        ).fetchone()
+        return self._watch_dict(row) if row is not None else None
+
+    def list_watches(self, owner: str | None = None, key: str | None = None) -> list[dict]:
+        query = ("SELECT w.id, w.group_key, w.owner, w.hotel_id, w.max_price, w.created_at, g.city_code, "
+                 "g.city_name, g.check_in_date, g.check_out_date, g.adults_count, g.children_count, g.checked_at "
+                 "FROM watches w JOIN watch_groups g ON g.key = w.group_key")
+        conditions, params = [], []
+        if owner is not None:
+            conditions.append("w.owner = ?")
+            params.append(owner)
+        if key is not None:
+            conditions.append("w.group_key = ?")
+            params.append(key)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return [self._watch_dict(row) for row in self._connection.execute(query + " ORDER BY w.id", params)]
+
+    def remove_watch(self, watch_id: int) -> bool:
+        removed = self._connection.execute("DELETE FROM watches WHERE id = ?", (watch_id,)).rowcount > 0
+        self._connection.commit()
+        return removed
+
+    def remove_group(self, key: str):
+        self._connection.execute("DELETE FROM watches WHERE group_key = ?", (key,))
+        self._connection.execute("DELETE FROM price_changes WHERE group_key = ?", (key,))
+        self._connection.execute("DELETE FROM watch_groups WHERE key = ?", (key,))
+        self._connection.commit()
+
+    def groups(self) -> list[sqlite3.Row]:
+        return self._connection.execute("SELECT * FROM watch_groups").fetchall()
+
+    def get_group(self, key: str) -> sqlite3.Row | None:
+        return self._connection.execute("SELECT * FROM watch_groups WHERE key = ?", (key,)).fetchone()
+
+    def count_watches(self, key: str) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM watches WHERE group_key = ?", (key,)).fetchone()[0]
+
+    def save_check(self, key: str, snapshot: dict | None, diff: dict | None, interval: float, next_run: float):
+        now = time.time()
+        # only the latest snapshot is kept, history lives in the diffs
+        if snapshot is not None:
+            self._connection.execute(
+                "UPDATE watch_groups SET snapshot = ?, checked_at = ?, interval = ?, next_run = ? WHERE key = ?",
+                (json.dumps(snapshot), now, interval, next_run, key)
+            )
+        else:
+            self._connection.execute("UPDATE watch_groups SET interval = ?, next_run = ? WHERE key = ?",
+                                     (interval, next_run, key))
+        if diff:
+            self._connection.execute("INSERT INTO price_changes (group_key, changed_at, diff) VALUES (?, ?, ?)",
+                                     (key, now, json.dumps(diff)))
+        self._connection.commit()
+
+    def changes(self, key: str, hotel_id: int | None = None, limit: int = 50) -> list[dict]:
+        rows = self._connection.execute(
+            "SELECT changed_at, diff FROM price_changes WHERE group_key = ? ORDER BY changed_at DESC LIMIT ?",
+            (key, limit)
+        ).fetchall()
+        changes = []
+        for row in rows:
+            diff = json.loads(row["diff"])
+            if hotel_id is not None:
+                diff = {str(hotel_id): diff[str(hotel_id)]} if str(hotel_id) in diff else {}
+            if diff:
+                changes.append({"changedAt": row["changed_at"], "hotels": diff})
+        return changes
+
+    @staticmethod
+    def _watch_dict(row: sqlite3.Row) -> dict:
+        return {
+            "watchId": row["id"],
+            "owner": row["owner"],
+            "cityId": row["city_code"],
+            "cityName": row["city_name"],
+            "checkInDate": row["check_in_date"],
+            "checkOutDate": row["check_out_date"],
+            "adultsCount": row["adults_count"],
+            "childrenCount": row["children_count"],
+            "hotelId": row["hotel_id"],
+            "maxPrice": row["max_price"],
+            "createdAt": row["created_at"],
+            "checkedAt": row["checked_at"],
+        }
+
+
+class PriceMonitor:
+    def __init__(self, store: MonitorStore, min_interval: float = MONITOR_MIN_INTERVAL,
+                 max_interval: float = MONITOR_MAX_INTERVAL, concurrency: int = MONITOR_CONCURRENCY):
+        self.store = store
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.concurrency = concurrency
+
+        self.counters = {"checks": 0, "changes": 0, "errors": 0, "events": 0, "dropped_events": 0}
+
+        # one heap entry per city/dates group, so thousands of watches on the same search cost one fetch
+        self._heap: list[tuple[float, str]] = []
+        self._next_runs: dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+        self._subscribers: set[asyncio.Queue] = set()
+        self._running: set[asyncio.Task] = set()
+        self._scheduler: asyncio.Task | None = None
+
+    async def start(self):
+        self.store.open()
+        for group in self.store.groups():
+            self._schedule(group["key"], group["next_run"])
+        self._scheduler = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._scheduler
+            self._scheduler = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self.store.close()
+
+    def add_watch(self, city_code: int, city_name: str, check_in_date: str, check_out_date: str, adults_count: int,
+                  children_count: int, owner: str | None = None, hotel_id: int | None = None,
+                  max_price: float | None = None) -> dict:
+        check_in = utils.parse_date(check_in_date).date()
+        check_out = utils.parse_date(check_out_date).date()
+        if check_out <= check_in:
+            raise ValueError("check out date must be after check in date")
+        if check_in < date.today():
+            raise ValueError("check in date is in the past")
+
+        key = group_key(city_code, check_in.isoformat(), check_out.isoformat(), adults_count, children_count)
+        watch, created = self.store.add_watch(key, int(city_code), city_name, check_in.isoformat(),
+                                              check_out.isoformat(), int(adults_count), int(children_count), owner,
+                                              hotel_id, max_price, self.min_interval)
+        if created:
+            # a new group is fetched right away to take the baseline snapshot
+            self._schedule(key, time.time())
+        else:
+            group = self.store.get_group(key)
+            if group is not None and group["snapshot"]:
+                event = baseline_event(watch, json.loads(group["snapshot"]))
+                if event is not None:
+                    self._publish(event)
+        return watch
+
+    def remove_watch(self, watch_id: int) -> bool:
+        return self.store.remove_watch(watch_id)
+
+    def get_watch(self, watch_id: int) -> dict | None:
+        return self.store.get_watch(watch_id)
+
+    def list_watches(self, owner: str | None = None) -> list[dict]:
+        return self.store.list_watches(owner=owner)
+
+    def watch_changes(self, watch_id: int, limit: int = 50) -> list[dict] | None:
+        watch = self.store.get_watch(watch_id)
+        if watch is None:
+            return None
+        key = group_key(watch["cityId"], watch["checkInDate"], watch["checkOutDate"], watch["adultsCount"],
+                        watch["childrenCount"])
+        return self.store.changes(key, watch["hotelId"], limit)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self):
+        queue = asyncio.Queue(maxsize=MONITOR_EVENT_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    def stats(self) -> dict[str, int]:
+        return {**self.counters, "groups": len(self._next_runs), "running": len(self._running),
+                "subscribers": len(self._subscribers)}
+
+    def _schedule(self, key: str, next_run: float):
+        # entries are never removed from the heap, a newer next_run just makes the old entry stale
+        self._next_runs[key] = next_run
+        heapq.heappush(self._heap, (next_run, key))
+        if self._heap[0][1] == key:
+            self._wakeup.set()
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+
+            next_run, key = heapq.heappop(self._heap)
+            if self._next_runs.get(key) != next_run:
+                continue
+            del self._next_runs[key]
+
+            await semaphore.acquire()
+            task = asyncio.create_task(self._check_group(key))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _check_group(self, key: str):
+        group = self.store.get_group(key)
+        if group is None:
+            return
+        if self.store.count_watches(key) == 0 or group["check_in_date"] < date.today().isoformat():
+            self.store.remove_group(key)
+            return
+
+        self.counters["checks"] += 1
+        try:
+            # goes through the shared hotels cache, so a watch on a search someone just ran costs no fetch
+            hotels = await get_hotels_for_city(group["city_code"], group["city_name"], group["check_in_date"],
+                                               group["check_out_date"], group["adults_count"],
+                                               group["children_count"])
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning("price monitor check of %s failed: %s", key, e)
+            interval = min(group["interval"] * 2, self.max_interval)
+            self.store.save_check(key, None, None, interval, time.time() + interval)
+            self._schedule(key, time.time() + interval)
+            return
+
+        snapshot = price_snapshot(hotels)
+        previous = json.loads(group["snapshot"]) if group["snapshot"] else None
+        diff = diff_snapshots(previous, snapshot) if previous is not None else {}
+
+        # poll faster while prices move and as the stay gets closer, back off while they stay put
+        interval = group["interval"] / 2 if diff else group["interval"] * 1.5
+        days_left = (utils.parse_date(group["check_in_date"]).timestamp() - time.time()) / 86400
+        interval = min(max(interval, self.min_interval), self.max_interval,
+                       max(self.min_interval, days_left * 3600))
+        self.store.save_check(key, snapshot, diff, interval, time.time() + interval)
+        self._schedule(key, time.time() + interval)
+
+        if previous is None:
+            # the baseline has nothing to diff against, but thresholds that are already met should still fire once
+            for watch in self.store.list_watches(key=key):
+                event = baseline_event(watch, snapshot)
+                if event is not None:
+                    self._publish(event)
+        elif diff:
+            self.counters["changes"] += 1
+            for watch in self.store.list_watches(key=key):
+                event = watch_event(watch, diff)
+                if event is not None:
+                    self._publish(event)
+
+    def _publish(self, event: dict):
+        self.counters["events"] += 1
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.counters["dropped_events"] += 1
+
+
+def watch_event(watch: dict, diff: dict[str, dict]) -> dict | None:
+    if watch["hotelId"] is not None:
+        changes = {hotel_id: change for hotel_id, change in diff.items() if hotel_id == str(watch["hotelId"])}
+    else:
+        changes = diff
+
+    max_price = watch["maxPrice"]
+    if max_price is not None:
+        # only alert when a hotel crosses below the threshold, not on every move below it
+        changes = {hotel_id: change for hotel_id, change in changes.items()
+                   if change["new"] is not None and change["new"] <= max_price
+                   and (change["old"] is None or change["old"] > max_price)}
+    if not changes:
+        return None
+
+    return {
+        "type": "watch_event",
+        "watchId": watch["watchId"],
+        "owner": watch["owner"],
+        "cityName": watch["cityName"],
+        "checkInDate": watch["checkInDate"],
+        "checkOutDate": watch["checkOutDate"],
+        "alert": max_price is not None,
+        "changes": [{"hotelId": int(hotel_id), "hotelName": change["name"], "oldPrice": change["old"],
+                     "newPrice": change["new"]} for hotel_id, change in changes.items()],
+    }
+
+
+def baseline_event(watch: dict, snapshot: dict[str, dict]) -> dict | None:
+    # evaluated once per watch, on the group's first snapshot or when the watch joins a group that has one;
+    # every priced hotel counts as newly seen so those already below max_price alert
+    if watch["maxPrice"] is None:
+        return None
+    diff = {hotel_id: {"name": entry["name"], "old": None, "new": entry["price"]}
+            for hotel_id, entry in snapshot.items()}
+    return watch_event(watch, diff)
+
+
+price_monitor = PriceMonitor(MonitorStore(MONITOR_DB_PATH))
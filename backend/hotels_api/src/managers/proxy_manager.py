@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+from src import metrics, utils
+from src.managers import rnet_manager
+from src.managers.rnet_manager import RnetManager
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PROXIES_RELOAD_INTERVAL = float(os.environ.get("PROXIES_RELOAD_INTERVAL", 10))
+UPSTREAM_LATENCY_BUDGET = float(os.environ.get("UPSTREAM_LATENCY_BUDGET", 20))
+UPSTREAM_ATTEMPTS = int(os.environ.get("UPSTREAM_ATTEMPTS", 3))
+
+
+class ProxyStats:
+    def __init__(self, proxy: str, alpha: float):
+        self.proxy = proxy
+        self.alpha = alpha
+
+        self.latency_ewma = 1.0
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.blocks = 0
+        self.consecutive_failures = 0
+
+        self.state = "closed"
+        self.open_seconds = 0.0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+
+    def available(self, now: float) -> bool:
+        if self.state == "open" and now >= self.open_until:
+            self.state = "half_open"
+        if self.state == "half_open":
+            return not self.probe_in_flight
+        return self.state == "closed"
+
+    def weight(self) -> float:
+        # the constant keeps fast proxies from starving the rest, so their stats still get refreshed
+        return (1 - self.error_rate) ** 2 / (self.latency_ewma + 0.5)
+
+    def record(self, latency: float, failed: bool):
+        if self.requests == 0:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += self.alpha * (latency - self.latency_ewma)
+        self.requests += 1
+        self.error_rate += self.alpha * (float(failed) - self.error_rate)
+
+    def to_dict(self) -> dict[str, object]:
+        return {
+            "proxy": self.proxy.rsplit("@", 1)[-1] or "direct",
+            "state": self.state,
+            "latencyEwma": round(self.latency_ewma, 3),
+            "errorRate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "failures": self.failures,
+            "blocks": self.blocks,
+            "openFor": round(max(self.open_until - time.monotonic(), 0), 1) if self.state == "open" else 0,
+        }
+
+
+class HedgingPolicy:
+    def __init__(self, enabled: bool, percentile: float = 95, max_ratio: float = 0.1, min_samples: int = 20,
+                 window: int = 200):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.window = window
+
+        self.counters = {"requests": 0, "fired": 0, "won": 0, "denied": 0}
+
+        self._latencies: dict[str, deque[float]] = {}
+        self._tokens = 0.0
+
+    def observe(self, operation: str, latency: float):
+        if operation not in self._latencies:
+            self._latencies[operation] = deque(maxlen=self.window)
+        self._latencies[operation].append(latency)
+
+    def delay(self, operation: str) -> float | None:
+        if not self.enabled:
+            return None
+        self.counters["requests"] += 1
+        # every request earns a fraction of a hedge, which caps extra upstream load at max_ratio
+        self._tokens = min(self._tokens + self.max_ratio, 10.0)
+        return self._observed_percentile(operation)
+
+    def acquire(self) -> bool:
+        if self._tokens < 1:
+            self.counters["denied"] += 1
+            return False
+        self._tokens -= 1
+        self.counters["fired"] += 1
+        return True
+
+    def to_dict(self) -> dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            **self.counters,
+            "delays": {operation: self._observed_percentile(operation) for operation in self._latencies},
+        }
+
+    def _observed_percentile(self, operation: str) -> float | None:
+        latencies = self._latencies.get(operation)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        latencies = sorted(latencies)
+        return latencies[min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)]
+
+
+class ProxyScheduler:
+    def __init__(self, proxies: list[str], alpha: float = 0.2, failure_threshold: int = 3,
+                 min_open_seconds: float = 15, max_open_seconds: float = 600, hedging: HedgingPolicy | None = None):
+        self.hedging = hedging or HedgingPolicy(enabled=False)
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.min_open_seconds = min_open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.stats = {proxy: ProxyStats(proxy, alpha) for proxy in proxies}
+
+    def set_proxies(self, proxies: list[str]):
+        # proxies that stay keep their stats and circuit state
+        self.stats = {proxy: self.stats.get(proxy) or ProxyStats(proxy, self.alpha) for proxy in proxies}
+
+    def choose(self, exclude: set[str] = frozenset()) -> str:
+        now = time.monotonic()
+        candidates = [stats for proxy, stats in self.stats.items() if proxy not in exclude and stats.available(now)]
+        if not candidates:
+            # every circuit is open: fall back to the one that reopens first instead of failing outright
+            fallback = [stats for proxy, stats in self.stats.items() if proxy not in exclude] or list(self.stats.values())
+            candidates = [min(fallback, key=lambda stats: stats.open_until)]
+
+        stats = random.choices(candidates, weights=[stats.weight() for stats in candidates])[0]
+        if stats.state == "half_open":
+            stats.probe_in_flight = True
+        return stats.proxy
+
+    def record_success(self, proxy: str, latency: float):
+        stats = self.stats.get(proxy)
+        if stats is None:
+            return
+        stats.record(latency, failed=False)
+        stats.consecutive_failures = 0
+        stats.probe_in_flight = False
+        stats.state = "closed"
+        stats.open_seconds = 0.0
+
+    def record_failure(self, proxy: str, latency: float, blocked: bool = False):
+        stats = self.stats.get(proxy)
+        if stats is None:
+            return
+        stats.record(latency, failed=True)
+        stats.failures += 1
+        stats.blocks += blocked
+        stats.consecutive_failures += 1
+        stats.probe_in_flight = False
+
+        if blocked or stats.state == "half_open" or stats.consecutive_failures >= self.failure_threshold:
+            stats.open_seconds = min(max(stats.open_seconds * 2, self.min_open_seconds), self.max_open_seconds)
+            stats.open_until = time.monotonic() + stats.open_seconds
+            stats.state = "open"
+
+    async def run(self, call: Callable[[RnetManager], Awaitable[T]], operation: str = "default",
+                  budget: float = UPSTREAM_LATENCY_BUDGET, attempts: int = UPSTREAM_ATTEMPTS) -> T:
+        deadline = time.monotonic() + budget
+        tried = set()
+        started_attempts = 0
+        last_error = None
+
+        while started_attempts < attempts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            # each attempt gets an equal share of what is left, so a stalled proxy can't eat the whole budget;
+            # time saved by fast failures carries over to the later attempts
+            timeout = remaining / (attempts - started_attempts)
+            started_attempts += 1
+
+            with metrics.span("proxy_select"):
+                proxy = self.choose(exclude=tried)
+            tried.add(proxy)
+            started = time.monotonic()
+            try:
+                return await asyncio.wait_for(self._hedged(call, operation, proxy, tried), timeout=timeout)
+            except utils.UpstreamSchemaError:
+                raise
+            except asyncio.TimeoutError as e:
+                self.record_failure(proxy, time.monotonic() - started)
+                last_error = e
+            except Exception as e:
+                last_error = e
+
+            if len(tried) == len(self.stats):
+                tried.clear()
+
+        raise utils.UpstreamError(f"upstream failed after {started_attempts} attempts: {last_error!r}")
+
+    async def _attempt(self, call: Callable[[RnetManager], Awaitable[T]], operation: str, proxy: str,
+                       leased: list[RnetManager]) -> T:
+        pool = await rnet_manager.get_pool()
+        started = time.monotonic()
+        try:
+            lease_started = time.perf_counter()
+            async with pool.lease(proxy, avoid=leased[0] if leased else None) as proxy_client:
+                metrics.observe("proxy_lease", time.perf_counter() - lease_started)
+                leased.append(proxy_client)
+                with metrics.span(f"upstream.{operation}"):
+                    result = await call(proxy_client)
+        except asyncio.CancelledError:
+            if proxy in self.stats:
+                self.stats[proxy].probe_in_flight = False
+            metrics.UPSTREAM_REQUESTS.labels(operation, "cancelled").inc()
+            raise
+        except utils.UpstreamSchemaError:
+            self.record_success(proxy, time.monotonic() - started)
+            metrics.UPSTREAM_REQUESTS.labels(operation, "invalid").inc()
+            raise
+        except utils.UpstreamBlockedError:
+            self.record_failure(proxy, time.monotonic() - started, blocked=True)
+            metrics.UPSTREAM_REQUESTS.labels(operation, "blocked").inc()
+            raise
+        except Exception:
+            self.record_failure(proxy, time.monotonic() - started)
+            metrics.UPSTREAM_REQUESTS.labels(operation, "error").inc()
+            raise
+
+        metrics.UPSTREAM_REQUESTS.labels(operation, "ok").inc()
+
+        latency = time.monotonic() - started
+        self.record_success(proxy, latency)
+        self.hedging.observe(operation, latency)
+        return result
+
+    async def _hedged(self, call: Callable[[RnetManager], Awaitable[T]], operation: str, proxy: str,
+                      tried: set[str]) -> T:
+        leased = []
+        primary = asyncio.ensure_future(self._attempt(call, operation, proxy, leased))
+        pending = {primary}
+        try:
+            delay = self.hedging.delay(operation)
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.hedging.acquire():
+                    hedge_proxy = self.choose(exclude=tried | {proxy}) if len(self.stats) > 1 else proxy
+                    hedge = asyncio.ensure_future(self._attempt(call, operation, hedge_proxy, leased))
+                    pending.add(hedge)
+
+                    # first success wins; a failure only counts once the other copy has failed too
+                    while pending:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            if task.exception() is None:
+                                if task is hedge:
+                                    self.hedging.counters["won"] += 1
+                                return task.result()
+                    return primary.result()
+
+            return await primary
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def to_list(self, pool_stats: dict[str, dict[str, int]] | None = None) -> list[dict[str, object]]:
+        pool_stats = pool_stats or {}
+        return [{**stats.to_dict(), **pool_stats.get(proxy, {})} for proxy, stats in self.stats.items()]
+
+
+proxy_scheduler = ProxyScheduler(utils.proxies, hedging=HedgingPolicy(
+    enabled=os.environ.get("UPSTREAM_HEDGING", "0") == "1",
+    percentile=float(os.environ.get("UPSTREAM_HEDGING_PERCENTILE", 95)),
+    max_ratio=float(os.environ.get("UPSTREAM_HEDGING_MAX_RATIO", 0.1)),
+))
+
+
+def reload_proxies() -> bool:
+    proxies = utils.load_proxies()
+    if proxies == utils.proxies:
+        return False
+
+    utils.proxies = proxies
+    proxy_scheduler.set_proxies(proxies)
+    if rnet_manager.rnet_pool is not None:
+        rnet_manager.rnet_pool.set_proxies(proxies)
+    logger.info("reloaded %d proxies from %s", len(proxies), utils.PROXIES_PATH)
+    return True
+
+
+def proxies_file_mtime() -> float | None:
+    try:
+        return os.stat(utils.PROXIES_PATH).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+async def watch_proxies_file(interval: float = PROXIES_RELOAD_INTERVAL):
+    # the first check always rereads the file, it may have changed between the import and this task starting
+    last_mtime = -1.0
+    while True:
+        await asyncio.sleep(interval)
+        mtime = proxies_file_mtime()
+        if mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        try:
+            reload_proxies()
+        except Exception:
+            logger.exception("couldn't reload proxies from %s", utils.PROXIES_PATH)
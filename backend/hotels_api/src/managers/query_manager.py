@@ -0,0 +1,67 @@
+import re
+from typing import Iterable, Literal
+
+import numpy as np
+
+from src.schemas import HOTEL_FIELDS, Hotel
+
+SortField = Literal["price", "stars", "score", "reviews"]
+
+NUMBER_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def parse_number(value: object) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = NUMBER_PATTERN.search(value)
+        if match:
+            return float(match.group(0).replace(",", ""))
+    return np.nan
+
+
+class HotelTable:
+    # built once per fetched hotel list and cached with it, so queries only run numpy over ready columns
+    def __init__(self, hotels: list[Hotel]):
+        self.hotels = hotels
+        self.columns: dict[str, np.ndarray] = {
+            "price": np.fromiter((parse_number(hotel.totalPrice) for hotel in hotels), np.float64, len(hotels)),
+            "stars": np.fromiter((parse_number(hotel.stars) for hotel in hotels), np.float64, len(hotels)),
+            "score": np.fromiter((parse_number(hotel.commentsScore) for hotel in hotels), np.float64, len(hotels)),
+            "reviews": np.fromiter((parse_number(hotel.commentsCount) for hotel in hotels), np.float64, len(hotels)),
+        }
+
+    def query(self, min_price: float | None = None, max_price: float | None = None, min_stars: float | None = None,
+              min_score: float | None = None, sort_by: SortField | None = None, descending: bool = False,
+              top_k: int | None = None, fields: Iterable[str] | None = None) -> list[Hotel] | list[dict]:
+        mask = np.ones(len(self.hotels), dtype=bool)
+        # comparisons against NaN are False, so hotels without a price or score drop out of those filters
+        if min_price is not None:
+            mask &= self.columns["price"] >= min_price
+        if max_price is not None:
+            mask &= self.columns["price"] <= max_price
+        if min_stars is not None:
+            mask &= self.columns["stars"] >= min_stars
+        if min_score is not None:
+            mask &= self.columns["score"] >= min_score
+
+        indices = np.flatnonzero(mask)
+        if sort_by is not None:
+            values = self.columns[sort_by][indices]
+            # negating keeps NaN at the end for both directions
+            order = np.argsort(-values if descending else values, kind="stable")
+            indices = indices[order]
+        if top_k is not None:
+            indices = indices[:top_k]
+
+        if fields is None:
+            return [self.hotels[i] for i in indices]
+        fields = [field for field in fields if field in HOTEL_FIELDS]
+        return [{field: getattr(self.hotels[i], field) for field in fields} for i in indices]
+
+
+def query_hotels(hotels: HotelTable | list[Hotel], **query) -> list[Hotel] | list[dict]:
+    if all(value is None for key, value in query.items() if key != "descending"):
+        return hotels.hotels if isinstance(hotels, HotelTable) else hotels
+    table = hotels if isinstance(hotels, HotelTable) else HotelTable(hotels)
+    return table.query(**query)
@@ -1,4 +1,7 @@
+import asyncio
+import contextlib
 import random
+import time
 
 import rnet
 from src import utils
@@ -6,6 +9,7 @@ from src import utils
 class RnetManager:
     def __init__(self, proxy: str | None = None):
         self.proxy = proxy
+        self.last_used = time.monotonic()
         rnet_init_kwargs = {}
         if proxy != "":
             username, password, host, port = proxy.replace('@', ':').split(':')
@@ -22,8 +26,135 @@ class RnetManager:
                 )
             ]
 
-        self.rnet_client = rnet.Client(impersonate=random.choice(utils.rnet_impersonations), **rnet_init_kwargs)
-    @classmethod
-    def init_random_proxy(cls):
-        proxy = random.choice(utils.proxies)
-        return cls(proxy=proxy)
\ No newline at end of file
+        self.rnet_client = rnet.Client(impersonate=random.choice(utils.rnet_impersonations()),
+                                       tcp_keepalive=60, pool_idle_timeout=90, **rnet_init_kwargs)
+
+
+class RnetPool:
+    def __init__(self, proxies: list[str], clients_per_proxy: int = 2, leases_per_client: int = 16,
+                 max_idle_seconds: float = 300, sweep_interval: float = 30):
+        self.proxies = list(proxies)
+        self.clients_per_proxy = clients_per_proxy
+        self.leases_per_client = leases_per_client
+        self.max_idle_seconds = max_idle_seconds
+        self.sweep_interval = sweep_interval
+
+        self._clients: dict[str, list[RnetManager]] = {proxy: [] for proxy in self.proxies}
+        self._leases: dict[int, int] = {}
+        self._slots: dict[str, asyncio.Semaphore] = {
+            proxy: asyncio.Semaphore(clients_per_proxy * leases_per_client) for proxy in self.proxies
+        }
+        self._sweeper: asyncio.Task | None = None
+        self._closed = False
+
+    async def start(self):
+        for proxy in self.proxies:
+            if not self._clients[proxy]:
+                self._add_client(proxy)
+        self._sweeper = asyncio.create_task(self._sweep_idle())
+
+    async def close(self):
+        self._closed = True
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._sweeper
+            self._sweeper = None
+        for clients in self._clients.values():
+            clients.clear()
+        self._leases.clear()
+
+    def set_proxies(self, proxies: list[str]):
+        # leases already holding a removed proxy's client finish normally, the client is just not handed out again
+        self.proxies = list(proxies)
+        for proxy in self.proxies:
+            if proxy not in self._clients:
+                self._clients[proxy] = []
+                self._slots[proxy] = asyncio.Semaphore(self.clients_per_proxy * self.leases_per_client)
+                if not self._closed:
+                    self._add_client(proxy)
+        for proxy in list(self._clients):
+            if proxy not in self.proxies:
+                for client in self._clients.pop(proxy):
+                    self._leases.pop(id(client), None)
+                del self._slots[proxy]
+
+    @contextlib.asynccontextmanager
+    async def lease(self, proxy: str | None = None, avoid: RnetManager | None = None):
+        if self._closed:
+            raise Exception("rnet pool is closed")
+        if proxy is None:
+            proxy = random.choice(self.proxies)
+        if proxy not in self._slots:
+            raise Exception("proxy is no longer configured")
+
+        async with self._slots[proxy]:
+            if proxy not in self._clients:
+                raise Exception("proxy was removed while waiting for a lease")
+            rnet_manager = self._pick_client(proxy, avoid)
+            self._leases[id(rnet_manager)] += 1
+            try:
+                yield rnet_manager
+            finally:
+                rnet_manager.last_used = time.monotonic()
+                if id(rnet_manager) in self._leases:
+                    self._leases[id(rnet_manager)] -= 1
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            proxy: {
+                "clients": len(clients),
+                "leased": sum(self._leases[id(client)] for client in clients),
+            }
+            for proxy, clients in self._clients.items()
+        }
+
+    def _add_client(self, proxy: str) -> RnetManager:
+        rnet_manager = RnetManager(proxy=proxy)
+        self._clients[proxy].append(rnet_manager)
+        self._leases[id(rnet_manager)] = 0
+        return rnet_manager
+
+    def _pick_client(self, proxy: str, avoid: RnetManager | None = None) -> RnetManager:
+        clients = [client for client in self._clients[proxy] if client is not avoid]
+        least_busy = min(clients, key=lambda client: self._leases[id(client)], default=None)
+        # every client keeps its own keep-alive connections, so only open another one when the warm ones are saturated
+        if least_busy is None or self._leases[id(least_busy)] >= self.leases_per_client:
+            if len(self._clients[proxy]) < self.clients_per_proxy:
+                return self._add_client(proxy)
+            return min(self._clients[proxy], key=lambda client: self._leases[id(client)])
+        return least_busy
+
+    async def _sweep_idle(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            deadline = time.monotonic() - self.max_idle_seconds
+            for clients in self._clients.values():
+                for client in list(clients):
+                    if self._leases[id(client)] == 0 and client.last_used < deadline:
+                        clients.remove(client)
+                        del self._leases[id(client)]
+
+
+rnet_pool: RnetPool | None = None
+
+
+async def start_pool(**kwargs) -> RnetPool:
+    global rnet_pool
+    if rnet_pool is None:
+        rnet_pool = RnetPool(utils.proxies, **kwargs)
+        await rnet_pool.start()
+    return rnet_pool
+
+
+async def close_pool():
+    global rnet_pool
+    if rnet_pool is not None:
+        await rnet_pool.close()
+        rnet_pool = None
+
+
+async def get_pool() -> RnetPool:
+    if rnet_pool is None:
+        return await start_pool()
+    return rnet_pool
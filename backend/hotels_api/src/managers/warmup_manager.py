@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from src import metrics
+from src.managers import rnet_manager
+from src.managers.hotels_manager import TRIP_BASE_URL, get_city
+from src.managers.proxy_manager import proxy_scheduler
+from src.managers.rnet_manager import RnetPool
+
+logger = logging.getLogger(__name__)
+
+WARMUP_CITIES = [city.strip() for city in os.environ.get("WARMUP_CITIES", "").split(",") if city.strip()]
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", 30))
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", 4))
+
+
+class StartupWarmup:
+    def __init__(self, cities: list[str], timeout: float = WARMUP_TIMEOUT, concurrency: int = WARMUP_CONCURRENCY):
+        self.cities = list(cities)
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+        self.state = "pending"
+        self.seconds = None
+        self.counters = {"connectionsOpened": 0, "connectionsFailed": 0, "citiesResolved": 0, "citiesFailed": 0}
+
+        self._task: asyncio.Task | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ("done", "timed_out", "disabled")
+
+    async def start(self):
+        if self.timeout <= 0:
+            self.state = "disabled"
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def to_dict(self) -> dict[str, object]:
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "seconds": self.seconds,
+            **self.counters,
+        }
+
+    async def _run(self):
+        self.state = "running"
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.gather(self._open_connections(), self._resolve_cities()),
+                                   timeout=self.timeout)
+            self.state = "done"
+        except asyncio.TimeoutError:
+            # a slow upstream shouldn't keep the service out of rotation, the remaining cold costs are paid lazily
+            logger.warning("warm-up didn't finish in %ss: %s", self.timeout, self.counters)
+            self.state = "timed_out"
+        self.seconds = round(time.perf_counter() - started, 3)
+        metrics.observe("warmup", self.seconds)
+
+    async def _open_connections(self):
+        pool = await rnet_manager.get_pool()
+        await asyncio.gather(*(self._open_connection(pool, proxy) for proxy in pool.proxies))
+
+    async def _open_connection(self, pool: RnetPool, proxy: str):
+        # leaves a keep-alive connection (TLS handshake included) in the proxy's client for the first real request
+        started = time.monotonic()
+        try:
+            async with pool.lease(proxy) as proxy_client:
+                response = await proxy_client.rnet_client.get(f"{TRIP_BASE_URL}/")
+                await response.text()
+        except Exception as e:
+            logger.warning("couldn't open a connection through proxy %s: %r", proxy.rsplit("@", 1)[-1] or "direct", e)
+            proxy_scheduler.record_failure(proxy, time.monotonic() - started)
+            self.counters["connectionsFailed"] += 1
+            return
+        proxy_scheduler.record_success(proxy, time.monotonic() - started)
+        self.counters["connectionsOpened"] += 1
+
+    async def _resolve_cities(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def resolve(city: str):
+            async with semaphore:
+                try:
+                    await get_city(city)
+                except Exception as e:
+                    logger.warning("couldn't pre-resolve city %s: %r", city, e)
+                    self.counters["citiesFailed"] += 1
+                    return
+                self.counters["citiesResolved"] += 1
+
+        await asyncio.gather(*(resolve(city) for city in self.cities))
+
+
+startup_warmup = StartupWarmup(WARMUP_CITIES)
@@ -0,0 +1,95 @@
+import contextlib
+import json
+import logging
+import os
+import time
+import uuid
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 2))
+REQUEST_ID_HEADER = "X-Request-ID"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram("hotels_api_request_seconds", "Time to handle an HTTP request",
+                            ["route", "status"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("hotels_api_stage_seconds", "Time spent in one stage of a request",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+UPSTREAM_REQUESTS = Counter("hotels_api_upstream_requests_total", "trip.com requests by outcome",
+                            ["operation", "outcome"])
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+# (stage, seconds) of every span finished while handling the current request
+request_spans: ContextVar[list[tuple[str, float]] | None] = ContextVar("request_spans", default=None)
+
+
+def observe(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    spans = request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+class RequestTracker:
+    def __init__(self, incoming_request_id: str | None):
+        self.request_id = incoming_request_id or uuid.uuid4().hex
+        self.route = "unmatched"
+        self.status = 500
+        self.spans: list[tuple[str, float]] = []
+        self.started = time.perf_counter()
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.started
+        REQUEST_SECONDS.labels(self.route, str(self.status)).observe(elapsed)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            logger.warning("slow request %s", json.dumps({
+                "requestId": self.request_id,
+                "route": self.route,
+                "status": self.status,
+                "seconds": round(elapsed, 3),
+                "stages": breakdown(self.spans),
+            }))
+
+    async def wrap_body(self, body):
+        # the headers go out before a streamed body is produced, so the request only ends with its last chunk
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            self.finish()
+
+
+@contextlib.contextmanager
+def track_request(incoming_request_id: str | None):
+    tracker = RequestTracker(incoming_request_id)
+    id_token = request_id.set(tracker.request_id)
+    spans_token = request_spans.set(tracker.spans)
+    try:
+        yield tracker
+    finally:
+        request_spans.reset(spans_token)
+        request_id.reset(id_token)
+
+
+def breakdown(spans: list[tuple[str, float]]) -> dict[str, dict[str, float]]:
+    # concurrent spans overlap, so the stage totals can add up to more than the request took
+    stages = {}
+    for stage, seconds in spans:
+        entry = stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+    return {stage: {"count": entry["count"], "seconds": round(entry["seconds"], 3)}
+            for stage, entry in sorted(stages.items(), key=lambda item: -item[1]["seconds"])}
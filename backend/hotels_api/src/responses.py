@@ -0,0 +1,14 @@
+from typing import Any
+
+import msgspec
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    # encodes dicts, lists and the msgspec structs from src.schemas without going through the stdlib encoder
+    def render(self, content: Any) -> bytes:
+        return msgspec.json.encode(content)
+
+
+def ndjson_line(item: Any) -> bytes:
+    return msgspec.json.encode(item) + b"\n"
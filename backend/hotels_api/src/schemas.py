@@ -0,0 +1,94 @@
+import msgspec
+
+
+# trip.com payloads, decoded straight into these; every field not listed here is skipped by the decoder
+
+class KeyWordCity(msgspec.Struct, gc=False):
+    enusName: str
+    geoCode: int
+
+
+class KeyWordSearchResult(msgspec.Struct, gc=False):
+    city: KeyWordCity
+
+
+class KeyWordSearchResponse(msgspec.Struct, gc=False):
+    keyWordSearchResults: list[KeyWordSearchResult] | None = None
+
+
+class HotelBasicInfo(msgspec.Struct, gc=False):
+    hotelId: int
+    hotelName: str
+    hotelAddress: str | None = None
+    priceExplanation: str | None = None
+
+
+class HotelStarInfo(msgspec.Struct, gc=False):
+    star: int | float | None = None
+
+
+class HotelCommentInfo(msgspec.Struct, gc=False):
+    commentScore: str | int | float | None = None
+    commenterNumber: str | None = None
+
+
+class AdvantageTag(msgspec.Struct, gc=False):
+    tagTitle: str | None = None
+
+
+class RoomTags(msgspec.Struct, gc=False):
+    advantageTags: list[AdvantageTag] | None = None
+
+
+class RawHotel(msgspec.Struct, gc=False):
+    hotelBasicInfo: HotelBasicInfo
+    hotelStarInfo: HotelStarInfo = msgspec.field(default_factory=HotelStarInfo)
+    commentInfo: HotelCommentInfo = msgspec.field(default_factory=HotelCommentInfo)
+    roomTags: RoomTags | None = None
+
+
+class HotelsPageData(msgspec.Struct, gc=False):
+    hotelList: list[RawHotel] | None = None
+
+
+class HotelsPageResponse(msgspec.Struct, gc=False):
+    data: HotelsPageData | None = None
+
+
+class RawComment(msgspec.Struct, gc=False):
+    content: str | None = None
+    rating: int | float | None = None
+    id: int | str | None = None
+    createDate: str | None = None
+    checkInDate: str | None = None
+    publishDate: str | None = None
+
+
+class CommentsData(msgspec.Struct, gc=False):
+    commentList: list[RawComment] | None = None
+    totalCount: int | None = None
+
+
+class CommentsResponse(msgspec.Struct, gc=False):
+    data: CommentsData | None = None
+
+
+# what hotels_api hands out
+
+class Hotel(msgspec.Struct, gc=False):
+    hotelId: int
+    hotelName: str
+    hotelAddress: str
+    stars: int | float
+    commentsScore: str | int | float | None
+    commentsCount: str
+    advantages: list[str]
+    totalPrice: str
+
+
+class Comment(msgspec.Struct, gc=False):
+    comment: str
+    rating: int | float
+
+
+HOTEL_FIELDS = Hotel.__struct_fields__
@@ -1,26 +1,66 @@
-import json
+import codecs
+import functools
+import os
 import re
 from datetime import datetime
-from typing import Iterable
+from typing import Any, AsyncIterable, Iterable
 import urllib.parse
 
+import msgspec
 import rnet
 
-with open("src/proxies.txt", "r") as f: proxies = f.read().splitlines()
+from src import metrics
 
-if not proxies:
-    proxies = [""]
+PROXIES_PATH = os.environ.get("PROXIES_PATH", os.path.join(os.path.dirname(__file__), "proxies.txt"))
 
-rnet_impersonations: list[rnet.Impersonate.Chrome136] = [getattr(rnet.Impersonate, k) for k in rnet.Impersonate.__dict__.keys() if not k.startswith("__") and not k.startswith("Ok")]
 
-async def get_response_json(coroutine):
+def load_proxies(path: str = PROXIES_PATH) -> list[str]:
+    # "" stands for a direct connection, used when no proxies are configured
+    try:
+        with open(path, "r") as f:
+            proxies = [line.strip() for line in f.read().splitlines()]
+    except FileNotFoundError:
+        return [""]
+    return [proxy for proxy in proxies if proxy and not proxy.startswith("#")] or [""]
+
+
+proxies = load_proxies()
+
+
+@functools.cache
+def rnet_impersonations() -> list[rnet.Impersonate.Chrome136]:
+    return [getattr(rnet.Impersonate, k) for k in rnet.Impersonate.__dict__.keys() if not k.startswith("__") and not k.startswith("Ok")]
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamBlockedError(UpstreamError):
+    pass
+
+
+class UpstreamSchemaError(UpstreamError):
+    # the proxy delivered the payload fine, retrying it through another one gets the same answer
+    pass
+
+
+async def get_response_json(coroutine, type=Any):
     response = await coroutine
     response_text = await response.text()
 
+    with metrics.span("parse"):
+        return decode_json(response_text, type)
+
+
+def decode_json(text: str, type=Any):
+    # only the fields declared on type are materialized, the rest of the payload is skipped
     try:
-        return json.loads(response_text)
-    except:
-        raise Exception(f"couldn't decode json: {response_text}")
+        return msgspec.json.decode(text, type=type)
+    except msgspec.ValidationError as e:
+        raise UpstreamSchemaError(f"unexpected response shape: {e}")
+    except msgspec.DecodeError:
+        raise UpstreamBlockedError(f"couldn't decode json: {text[:500]}")
 
 def to_query_param(param):
     if isinstance(param, str):
@@ -63,4 +103,85 @@ def filter_string(string: str, start: str = None, end: str = None, include_start
                 string = string[:end_match.end()]
             else:
                 string = string[:end_match.start()]
-    return string
\ No newline at end of file
+    return string
+
+_JSON_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+# both patterns consume everything the scanner does not care about inside the regex engine and stop at the next
+# interesting token: a lone quote means a string is cut by the chunk boundary, \Z means the chunk is exhausted
+_JSON_KEY_OR_BRACKET = re.compile(
+    rf'(?:[^"{{}}\[\]]+|{_JSON_STRING}(?!\s*(?::|\Z)))*(?:({_JSON_STRING})\s*:|([{{}}\[\]])|(")|\Z)'
+)
+_JSON_BRACKET = re.compile(rf'(?:[^"{{}}\[\]]+|{_JSON_STRING})*(?:([{{}}\[\]])|(")|\Z)')
+
+async def extract_json_subtree(chunks: AsyncIterable[bytes], marker: str, path: Iterable[str], type=Any):
+    path = tuple(path)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    buffer = ""
+    marker_found = False
+    keys = []
+    pending_key = None
+    subtree_parts = None
+    subtree_start = 0
+    subtree_depth = 0
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        pos = 0
+
+        if not marker_found:
+            marker_index = buffer.find(marker)
+            if marker_index == -1:
+                buffer = buffer[-len(marker):]
+                continue
+            marker_found = True
+            pos = marker_index + len(marker)
+
+        while subtree_parts is None:
+            match = _JSON_KEY_OR_BRACKET.match(buffer, pos)
+            key, bracket, cut_string = match.groups()
+            if key is None and bracket is None:
+                pos = match.start(3) if cut_string is not None else len(buffer)
+                break
+
+            pos = match.end()
+            if key is not None:
+                pending_key = key[1:-1]
+            elif bracket in "{[":
+                keys.append(pending_key)
+                pending_key = None
+                if tuple(keys[1:]) == path:
+                    subtree_parts = []
+                    subtree_start = pos - 1
+                    subtree_depth = 1
+            else:
+                pending_key = None
+                if not keys:
+                    raise UpstreamError(f"unbalanced json after {marker}")
+                keys.pop()
+                if not keys:
+                    raise UpstreamError(f"{'.'.join(path)} not found after {marker}")
+
+        while subtree_parts is not None:
+            match = _JSON_BRACKET.match(buffer, pos)
+            bracket, cut_string = match.groups()
+            if bracket is None:
+                pos = match.start(2) if cut_string is not None else len(buffer)
+                break
+
+            pos = match.end()
+            subtree_depth += 1 if bracket in "{[" else -1
+            if subtree_depth == 0:
+                subtree_parts.append(buffer[subtree_start:pos])
+                with metrics.span("parse"):
+                    return decode_json("".join(subtree_parts), type)
+
+        if subtree_parts is not None:
+            subtree_parts.append(buffer[subtree_start:pos])
+            subtree_start = 0
+        buffer = buffer[pos:]
+
+    if not marker_found:
+        # trip.com answers with a captcha or challenge page instead of the listing
+        raise UpstreamBlockedError(f"{marker} not found in response")
+    raise UpstreamError(f"response ended before {'.'.join(path)} after {marker} was complete")
@@ -41,7 +41,9 @@ const ChatInterface = () => {
   const connectWebSocket = () => {
     // Adjust the URL to match your backend
     setIsReconnecting(true);
-    const ws = new WebSocket('ws://localhost:8080/ws/chat');
+    // The client id outlives the connection so price watches survive reconnects and page reloads
+    const clientId = localStorage.getItem('clientId');
+    const ws = new WebSocket('ws://localhost:8080/ws/chat' + (clientId ? `?clientId=${encodeURIComponent(clientId)}` : ''));
     
     ws.onopen = () => {
       console.log('WebSocket connected');
@@ -61,6 +63,27 @@ const ChatInterface = () => {
           setMessages(prev => [...prev, { role: 'assistant', content: data.content }]);
           setIsLoading(false);
           break;
+        case 'ai_message_delta':
+          setMessages(prev => {
+            const last = prev[prev.length - 1];
+            if (last && last.role === 'assistant' && last.streaming) {
+              return [...prev.slice(0, -1), { ...last, content: last.content + data.content }];
+            }
+            return [...prev, { role: 'assistant', content: data.content, streaming: true }];
+          });
+          break;
+        case 'ai_message_end':
+          setMessages(prev => {
+            const last = prev[prev.length - 1];
+            if (last && last.role === 'assistant' && last.streaming) {
+              return [...prev.slice(0, -1), { role: 'assistant', content: data.content }];
+            }
+            return data.content ? [...prev, { role: 'assistant', content: data.content }] : prev;
+          });
+          if (data.final) {
+            setIsLoading(false);
+          }
+          break;
         case 'tool_start':
           setMessages(prev => [...prev, { role: 'system', content: `Using tool: ${data.name}...` }]);
           break;
@@ -77,6 +100,30 @@ const ChatInterface = () => {
             content: `Error from tool ${data.name}: ${data.error}` 
           }]);
           break;
+        case 'session':
+          localStorage.setItem('clientId', data.clientId);
+          break;
+        case 'queue_position':
+          setMessages(prev => {
+            const content = `Assistant is busy, you are number ${data.position} in the queue...`;
+            const last = prev[prev.length - 1];
+            if (last && last.role === 'system' && last.queued) {
+              return [...prev.slice(0, -1), { role: 'system', content, queued: true }];
+            }
+            return [...prev, { role: 'system', content, queued: true }];
+          });
+          break;
+        case 'watch_event':
+          setMessages(prev => [...prev, {
+            role: 'system',
+            content: `${data.alert ? 'Price alert' : 'Price change'} for watch ${data.watchId} in ${data.cityName} (${data.checkInDate} - ${data.checkOutDate}):`,
+            data: data.changes
+          }]);
+          break;
+        case 'error':
+          setMessages(prev => [...prev, { role: 'system', content: `Error: ${data.error}` }]);
+          setIsLoading(false);
+          break;
         default:
           console.warn('Unknown message type:', data.type);
       }